@@ -0,0 +1,146 @@
+"""
+conformance of pmpm/htmlwriter.py to pandoc's html5 writer
+
+Renders the blocks of markdown documents with pandoc and with blocks2html,
+and reports the blocks blocks2html supports but renders differently, along
+with the share of blocks it supports:
+
+    python bench/conformance.py [--pandoc stub|real] [FILE ...]
+
+Without files, the conformance samples of htmlwriter.py and the documents of
+generate.py are checked. Exits with status 1 if any block differs.
+
+    python bench/conformance.py --golden tests/golden
+
+writes pandoc's json and html of the samples and of the markdown files in
+tests/golden instead, which tests/test_htmlwriter.py compares blocks2html to
+without pandoc.
+"""
+
+
+import argparse
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+
+import generate
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+from pmpm.htmlwriter import (  # noqa: E402
+    CONFORMANCE_MARKDOWN, blocks2html, conformance)
+
+
+SENTINEL = "<!-- pmpm-conformance -->"
+
+
+def pandoc(args, text, env):
+    return subprocess.run(("pandoc", *args), input=text.encode(), env=env,
+                          stdout=subprocess.PIPE, check=True
+                          ).stdout.decode()
+
+
+def render(markdown, env):
+    """ pandoc's json of markdown, and its html of each block preceded by a
+    SENTINEL line """
+    jsontxt = pandoc(("--from", "markdown+emoji", "--to", "json"), markdown,
+                     env)
+    jsonout = json.loads(jsontxt)
+    sentinel = {"t": "RawBlock", "c": ["html", SENTINEL]}
+    html = pandoc(
+        ("--from", "json", "--to", "html5", "--wrap=none"),
+        json.dumps({"blocks": [b for j in jsonout["blocks"]
+                               for b in (sentinel, j)],
+                    "meta": {},
+                    "pandoc-api-version": jsonout["pandoc-api-version"]}),
+        env)
+    return jsontxt, html
+
+
+def check(name, markdown, env):
+    """ print the blocks of markdown that blocks2html gets wrong
+
+    Returns:
+        (number of blocks, supported blocks, mismatches)
+
+    """
+    jsontxt, html = render(markdown, env)
+    blocks = json.loads(jsontxt)["blocks"]
+    htmls = html.split(SENTINEL + "\n")[1:]
+    supported = sum(blocks2html([b]) is not None for b in blocks)
+    mismatches = 0
+    for block, expected, got in conformance(blocks, htmls):
+        mismatches += 1
+        print(f"{name}: {json.dumps(block)}\n"
+              f"  pandoc:      {expected!r}\n"
+              f"  blocks2html: {got!r}")
+    return len(blocks), supported, mismatches
+
+
+def golden(directory, env):
+    """ write the json and html of the samples and of directory/*.md """
+    (directory / "samples.md").write_text(CONFORMANCE_MARKDOWN)
+    for path in sorted(directory.glob("*.md")):
+        jsontxt, html = render(path.read_text(), env)
+        for suffix, text in ((".json", jsontxt), (".html", html)):
+            path.with_suffix(suffix).write_text(text)
+            print(f"wrote {path.with_suffix(suffix)}")
+    (directory / "pandoc-version").write_text(
+        pandoc(("--version",), "", env).splitlines()[0] + "\n")
+    return 0
+
+
+def main(args):
+    env = dict(os.environ)
+    if args.pandoc == "stub":
+        env["PATH"] = f"{BENCH_DIR / 'stub'}{os.pathsep}{env['PATH']}"
+    if args.golden is not None:
+        return golden(args.golden, env)
+    with tempfile.TemporaryDirectory(prefix="pmpm-conformance-") as tmp:
+        if args.files:
+            documents = {str(f): Path(f) for f in args.files}
+        else:
+            documents = {f"{kind}-{size}": path
+                         for (kind, size), path
+                         in generate.write(tmp).items()
+                         if size != "large"}
+        results = {"samples": check("samples", CONFORMANCE_MARKDOWN, env)}
+        for name, path in documents.items():
+            results[name] = check(name, path.read_text(), env)
+
+    print(f"{'document':20} {'blocks':>7} {'python':>7} {'differ':>7}")
+    for name, (n, supported, mismatches) in results.items():
+        print(f"{name:20} {n:7} {supported:7} {mismatches:7}")
+    return 1 if any(m for _, _, m in results.values()) else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="compare pmpm's python html writer with pandoc")
+    parser.add_argument(
+        "--pandoc",
+        default="real",
+        choices=["stub", "real"],
+        help="use the pandoc on PATH or the deterministic bench/stub/pandoc",
+    )
+    parser.add_argument(
+        "--golden",
+        type=Path,
+        metavar="DIRECTORY",
+        help="write pandoc's json and html of the samples and of the "
+        "markdown files in DIRECTORY, for tests/test_htmlwriter.py",
+    )
+    parser.add_argument(
+        "files",
+        nargs="*",
+        help="markdown files to check",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,144 @@
+"""
+synthetic markdown documents for benchmarks
+
+Each generator returns the markdown of a document with about n blocks; the
+text is pseudo-random but deterministic for a given seed, so that the same
+documents are rendered on every run.
+
+    python bench/generate.py DIRECTORY
+
+writes all KINDS at all SIZES to DIRECTORY, along with the bibliography the
+citation-heavy documents cite.
+"""
+
+
+import argparse
+from pathlib import Path
+import random
+
+
+SIZES = {"small": 20, "medium": 200, "large": 2000}
+
+WORDS = ("pandoc markdown preview machine render block cache latency "
+         "websocket browser pipe document paragraph citation equation slide "
+         "estimate model sample variance causal effect graph").split()
+
+BIBLIOGRAPHY = "references.bib"
+NREFERENCES = 200
+
+
+def sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def paragraph(rng, sentences=4):
+    return " ".join(sentence(rng) for _ in range(sentences))
+
+
+def paragraphs(n, seed=0):
+    """ prose: sections of plain paragraphs """
+    rng = random.Random(seed)
+    blocks = ["---\ntitle: Paragraphs\n---"]
+    for k in range(n):
+        if k % 10 == 0:
+            blocks.append(f"## Section {k // 10 + 1}")
+        blocks.append(paragraph(rng))
+    return "\n\n".join(blocks) + "\n"
+
+
+def math(n, seed=0):
+    """ paragraphs with inline math, and display math """
+    rng = random.Random(seed)
+    blocks = ["---\ntitle: Math\n---"]
+    for k in range(n):
+        if k % 3 == 0:
+            blocks.append(f"$$\\sum_{{i=1}}^{{{k + 2}}} x_i^2 = "
+                          f"\\int_0^{k + 1} f(t)\\,dt$$")
+        else:
+            words = paragraph(rng).split()
+            for i in range(0, len(words), 6):
+                words[i] = f"$x_{{{i}}}^{{{k}}}$"
+            blocks.append(" ".join(words))
+    return "\n\n".join(blocks) + "\n"
+
+
+def citations(n, seed=0):
+    """ paragraphs citing entries of BIBLIOGRAPHY """
+    rng = random.Random(seed)
+    blocks = [f"---\ntitle: Citations\nbibliography: {BIBLIOGRAPHY}\n---"]
+    for k in range(n):
+        cites = "; ".join(f"@ref{rng.randrange(NREFERENCES)}"
+                          for _ in range(rng.randint(1, 3)))
+        blocks.append(f"{paragraph(rng, 2)} [{cites}] {sentence(rng)}")
+    return "\n\n".join(blocks) + "\n"
+
+
+def slides(n, seed=0):
+    """ revealjs slides, a few paragraphs each """
+    rng = random.Random(seed)
+    blocks = ["<!-- revealjs -->\n---\ntitle: Slides\n---"]
+    for k in range(n):
+        if k % 4 == 0:
+            blocks.append(f"## Slide {k // 4 + 1}")
+        blocks.append(paragraph(rng, 2))
+    return "\n\n".join(blocks) + "\n"
+
+
+KINDS = {"paragraphs": paragraphs,
+         "math": math,
+         "citations": citations,
+         "slides": slides}
+
+
+def bibliography():
+    rng = random.Random(0)
+    return "\n\n".join(
+        f"@article{{ref{k},\n"
+        f"  title = {{{sentence(rng, 6)}}},\n"
+        f"  author = {{Author, A{k}}},\n"
+        f"  journal = {{Journal of {rng.choice(WORDS).capitalize()}}},\n"
+        f"  year = {{{1990 + k % 30}}}\n"
+        "}"
+        for k in range(NREFERENCES)) + "\n"
+
+
+def edit(content, k):
+    """ content with its k-th paragraph from the end changed, as if typed """
+    blocks = content.split("\n\n")
+    index = max(len(blocks) - 1 - k % len(blocks), 1)
+    blocks[index] += f" Edit {k}."
+    return "\n\n".join(blocks)
+
+
+def write(directory):
+    """ write all documents and the bibliography to directory
+
+    Returns:
+        documents: {(kind, size): path}
+
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / BIBLIOGRAPHY).write_text(bibliography())
+    documents = {}
+    for kind, generate in KINDS.items():
+        for size, n in SIZES.items():
+            path = directory / f"{kind}-{size}.md"
+            path.write_text(generate(n))
+            documents[kind, size] = path
+    return documents
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="synthetic markdown documents for benchmarks")
+    parser.add_argument(
+        "directory",
+        help="directory to write the documents and the bibliography to",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    for path in write(parse_args().directory).values():
+        print(path)
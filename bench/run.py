@@ -0,0 +1,255 @@
+"""
+end-to-end benchmark of pmpm-websocket
+
+For each generated document (see generate.py), a fresh pmpm-websocket is
+started, and the document is piped to it while a websocket client, speaking
+the delta protocol like pmpm.js, waits for the rendered result:
+
+cold:
+    latency of the first render, with empty caches
+warm:
+    latency of rendering the same content again
+edit:
+    latencies of successive edits, each waiting for the previous render
+burst:
+    edits piped in back to back, the time until the last one is shown and
+    the edits per second
+rss:
+    peak resident memory of pmpm-websocket (without pandoc processes)
+
+    python bench/run.py [--pandoc stub|real] [--kinds ...] [--sizes ...]
+                        [-- pmpm-websocket arguments]
+
+With the default --pandoc stub, bench/stub/pandoc is used, so that results
+are comparable on any Linux box. Results are printed and written as json to
+bench/results/.
+"""
+
+
+import argparse
+import asyncio
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+import generate
+
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+
+# the delta protocol version of pmpm.js
+DELTA_PROTOCOL_VERSION = 1
+
+
+def freeport():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def peakrss(pid):
+    """ peak resident memory of process pid in MB """
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+class Server:
+    """ a pmpm-websocket process with its own runtime directory """
+
+    def __init__(self, home, pandoc, args):
+        self.home = home
+        self.port = freeport()
+        self._runtime = tempfile.TemporaryDirectory(prefix="pmpm-bench-")
+        self.pipe = Path(self._runtime.name) / "pmpm" / "pipe"
+        env = dict(os.environ,
+                   XDG_RUNTIME_DIR=self._runtime.name,
+                   PYTHONPATH=str(REPO_DIR))
+        if pandoc == "stub":
+            env["PATH"] = f"{BENCH_DIR / 'stub'}{os.pathsep}{env['PATH']}"
+        self.proc = subprocess.Popen(
+            [sys.executable, "-c",
+             "from pmpm.websocket import run_websocket_server; "
+             "run_websocket_server()",
+             "--port", str(self.port), "--home", str(home), *args],
+            env=env,
+            stdout=subprocess.DEVNULL)
+
+    async def connect(self):
+        for _ in range(100):
+            try:
+                client = await websockets.connect(
+                    f"ws://127.0.0.1:{self.port}/", max_size=None)
+            except OSError:
+                await asyncio.sleep(.1)
+                continue
+            await client.send(f"protocol:{DELTA_PROTOCOL_VERSION}")
+            return client
+        raise RuntimeError("pmpm-websocket did not start")
+
+    def stop(self):
+        self.proc.kill()
+        self.proc.wait()
+        self._runtime.cleanup()
+
+
+class Client:
+    """ receives the rendered documents """
+
+    def __init__(self, websocket):
+        self._websocket = websocket
+        self._rendered = asyncio.Queue()
+        # html of the blocks received so far, by hash
+        self._blocks = {}
+        self._reader = asyncio.get_event_loop().create_task(self._read())
+
+    async def _read(self):
+        async for message in self._websocket:
+            message = json.loads(message)
+            if "blockorder" not in message:
+                continue
+            # like pmpm.js, the document is blockorder, with the blocks
+            # sent now or before (with --stream, in partial messages)
+            self._blocks.update(message["newblocks"])
+            if not message.get("partial"):
+                self._rendered.put_nowait(
+                    (time.perf_counter(),
+                     "".join(self._blocks[h] for h in message["blockorder"])))
+
+    async def rendered(self, marker=None):
+        """ the time the next render (with marker) arrived """
+        while True:
+            arrived, html = await self._rendered.get()
+            if marker is None or marker in html:
+                return arrived
+
+    async def close(self):
+        self._reader.cancel()
+        await self._websocket.close()
+
+
+async def send(server, path, content):
+    """ pipe content to the server, returns the time it was sent """
+    message = f"<!-- filepath:{path} -->\n{content}\0".encode()
+    start = time.perf_counter()
+    await asyncio.get_event_loop().run_in_executor(
+        None, server.pipe.write_bytes, message)
+    return start
+
+
+async def bench_document(server, path, edits):
+    client = Client(await server.connect())
+    content = path.read_text()
+    result = {"bytes": len(content.encode())}
+    try:
+        start = await send(server, path, content)
+        result["cold"] = await client.rendered() - start
+        start = await send(server, path, content)
+        result["warm"] = await client.rendered() - start
+
+        latencies = []
+        for k in range(edits):
+            start = await send(server, path, generate.edit(content, k))
+            latencies.append(
+                await client.rendered(f"Edit {k}.") - start)
+        result["edit"] = statistics.median(latencies)
+        result["edit-max"] = max(latencies)
+
+        start = time.perf_counter()
+        for k in range(edits, 2 * edits):
+            await send(server, path, generate.edit(content, k))
+        settled = await client.rendered(f"Edit {2 * edits - 1}.") - start
+        result["burst"] = settled
+        result["burst-edits/s"] = edits / settled
+    finally:
+        await client.close()
+    result["rss"] = peakrss(server.proc.pid)
+    return result
+
+
+def table(results):
+    columns = ("cold", "warm", "edit", "edit-max", "burst")
+    lines = [f"{'document':20} {'KB':>7} "
+             + " ".join(f"{c:>9}" for c in columns)
+             + f" {'edits/s':>8} {'RSS MB':>7}"]
+    for name, r in results.items():
+        lines.append(f"{name:20} {r['bytes'] / 1024:7.0f} "
+                     + " ".join(f"{r[c] * 1000:7.0f}ms" for c in columns)
+                     + f" {r['burst-edits/s']:8.1f} {r['rss']:7.0f}")
+    return "\n".join(lines)
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory(prefix="pmpm-bench-docs-") as home:
+        documents = generate.write(home)
+        results = {}
+        for (kind, size), path in documents.items():
+            if kind not in args.kinds or size not in args.sizes:
+                continue
+            server = Server(home, args.pandoc, args.server_args)
+            try:
+                results[f"{kind}-{size}"] = await bench_document(
+                    server, path, args.edits)
+            finally:
+                server.stop()
+            print(f"{kind}-{size} done", file=sys.stderr)
+
+    print(table(results))
+    outdir = BENCH_DIR / "results"
+    outdir.mkdir(exist_ok=True)
+    outfile = outdir / f"{datetime.now():%Y%m%d-%H%M%S}-{args.pandoc}.json"
+    outfile.write_text(json.dumps({"pandoc": args.pandoc,
+                                   "server-args": args.server_args,
+                                   "results": results}, indent=1))
+    print(f"written to {outfile}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="end-to-end benchmark of pmpm-websocket")
+    parser.add_argument(
+        "--pandoc",
+        default="stub",
+        choices=["stub", "real"],
+        help="use the deterministic bench/stub/pandoc or the pandoc on PATH",
+    )
+    parser.add_argument(
+        "--kinds",
+        nargs="+",
+        default=list(generate.KINDS),
+        choices=list(generate.KINDS),
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=list(generate.SIZES),
+        choices=list(generate.SIZES),
+    )
+    parser.add_argument(
+        "--edits",
+        type=int,
+        default=10,
+        help="number of edits, and of edits in the burst",
+    )
+    parser.add_argument(
+        "server_args",
+        nargs="*",
+        help="arguments for pmpm-websocket, after --",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,192 @@
+"""
+startup benchmark of pmpm-websocket
+
+Measures how long a browser and an editor wait for a freshly started
+pmpm-websocket, as with systemd socket activation, where the server is only
+started by the first connection:
+
+connect:
+    until the websocket handshake of a client connecting right away is done
+render:
+    until a small document piped in right away is shown to that client
+
+The first start has no pandoc capability record yet (see
+websocket.pandoc_capabilities), the later starts reuse it.
+
+    python bench/startup.py [--pandoc stub|real] [--starts N]
+                            [-- pmpm-websocket arguments]
+
+If python-systemd is installed, the sockets are bound beforehand and passed
+to pmpm-websocket like systemd does, otherwise pmpm-websocket binds them
+itself. Results are printed and written as json to bench/results/.
+"""
+
+
+import argparse
+import asyncio
+from datetime import datetime
+import fcntl
+import importlib.util
+import json
+import os
+from pathlib import Path
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+import generate
+import run
+
+
+SOCKET_ACTIVATION = importlib.util.find_spec("systemd") is not None
+
+# the first file descriptor systemd passes
+SD_LISTEN_FDS_START = 3
+
+
+class ColdServer:
+    """ a pmpm-websocket process started by its first connection """
+
+    def __init__(self, home, cachehome, pandoc, args):
+        self.port = run.freeport()
+        self._runtime = tempfile.TemporaryDirectory(prefix="pmpm-bench-")
+        self.pipe = Path(self._runtime.name) / "pmpm" / "pipe"
+        env = dict(os.environ,
+                   XDG_RUNTIME_DIR=self._runtime.name,
+                   XDG_CACHE_HOME=str(cachehome),
+                   PYTHONPATH=os.pathsep.join(
+                       [str(run.REPO_DIR), os.environ.get("PYTHONPATH", "")]))
+        if pandoc == "stub":
+            env["PATH"] = f"{run.BENCH_DIR / 'stub'}{os.pathsep}{env['PATH']}"
+        command = [sys.executable, "-c",
+                   "from pmpm.websocket import run_websocket_server; "
+                   "run_websocket_server()",
+                   "--port", str(self.port), "--home", str(home), *args]
+        self._fds = []
+        if SOCKET_ACTIVATION:
+            self._listen()
+            env["LISTEN_FDS"] = str(len(self._fds))
+            # LISTEN_PID has to be the pid of pmpm-websocket
+            command = ["sh", "-c", 'LISTEN_PID=$$ exec "$@"', "sh", *command]
+        self.start = time.perf_counter()
+        self.proc = subprocess.Popen(
+            command, env=env, stdout=subprocess.DEVNULL,
+            preexec_fn=self._passfds if SOCKET_ACTIVATION else None,
+            pass_fds=range(SD_LISTEN_FDS_START,
+                           SD_LISTEN_FDS_START + len(self._fds)))
+
+    def _listen(self):
+        """ the pipe and the websocket socket, as systemd passes them """
+        self.pipe.parent.mkdir()
+        os.mkfifo(self.pipe)
+        fd_pipe = os.open(self.pipe, os.O_RDWR | os.O_NONBLOCK)
+        self._socket = socket.socket()
+        self._socket.bind(("127.0.0.1", self.port))
+        self._socket.listen()
+        # out of the way of the file descriptors they are passed as
+        self._fds = [fcntl.fcntl(fd, fcntl.F_DUPFD, 10)
+                     for fd in (fd_pipe, self._socket.fileno())]
+        os.close(fd_pipe)
+
+    def _passfds(self):
+        for k, fd in enumerate(self._fds):
+            os.dup2(fd, SD_LISTEN_FDS_START + k)
+
+    def stop(self):
+        self.proc.kill()
+        self.proc.wait()
+        for fd in self._fds:
+            os.close(fd)
+        if SOCKET_ACTIVATION:
+            self._socket.close()
+        self._runtime.cleanup()
+
+
+async def connect(server):
+    for _ in range(1000):
+        try:
+            client = await websockets.connect(
+                f"ws://127.0.0.1:{server.port}/", max_size=None)
+        except OSError:
+            await asyncio.sleep(.005)
+            continue
+        await client.send(f"protocol:{run.DELTA_PROTOCOL_VERSION}")
+        return client
+    raise RuntimeError("pmpm-websocket did not start")
+
+
+async def bench_start(server, path, content):
+    client = run.Client(await connect(server))
+    connected = time.perf_counter() - server.start
+    try:
+        await run.send(server, path, content)
+        rendered = await client.rendered() - server.start
+    finally:
+        await client.close()
+    return {"connect": connected, "render": rendered}
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory(prefix="pmpm-bench-docs-") as home, \
+            tempfile.TemporaryDirectory(prefix="pmpm-bench-cache-") as cache:
+        path = Path(home) / "startup.md"
+        content = generate.paragraphs(generate.SIZES["small"])
+        path.write_text(content)
+        starts = []
+        for _ in range(args.starts):
+            server = ColdServer(home, cache, args.pandoc, args.server_args)
+            try:
+                starts.append(await bench_start(server, path, content))
+            finally:
+                server.stop()
+
+    results = {"first": starts[0]}
+    if len(starts) > 1:
+        results["later"] = {key: statistics.median(s[key] for s in starts[1:])
+                            for key in starts[0]}
+    print(f"socket activation: {'yes' if SOCKET_ACTIVATION else 'no'}")
+    print(f"{'start':8} {'connect':>9} {'render':>9}")
+    for name, r in results.items():
+        print(f"{name:8} {r['connect'] * 1000:7.0f}ms "
+              f"{r['render'] * 1000:7.0f}ms")
+    outdir = run.BENCH_DIR / "results"
+    outdir.mkdir(exist_ok=True)
+    outfile = (outdir
+               / f"{datetime.now():%Y%m%d-%H%M%S}-startup-{args.pandoc}.json")
+    outfile.write_text(json.dumps({"pandoc": args.pandoc,
+                                   "socket-activation": SOCKET_ACTIVATION,
+                                   "server-args": args.server_args,
+                                   "results": results}, indent=1))
+    print(f"written to {outfile}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="startup benchmark of pmpm-websocket")
+    parser.add_argument(
+        "--pandoc",
+        default="stub",
+        choices=["stub", "real"],
+        help="use the deterministic bench/stub/pandoc or the pandoc on PATH",
+    )
+    parser.add_argument(
+        "--starts",
+        type=int,
+        default=10,
+        help="number of starts, the first without capability record",
+    )
+    parser.add_argument(
+        "server_args",
+        nargs="*",
+        help="arguments for pmpm-websocket, after --",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
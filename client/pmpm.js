@@ -174,10 +174,13 @@ let fpathLoadMessagePrefix = 'filepath:';
 let contentBibid;
 let citeprocBibid;
 let suppressBibliography = false;
-let fpath, port;
-({fpath, port} = (() => {
+let fpath, port, followPipe;
+({fpath, port, followPipe} = (() => {
     const tmp = new URLSearchParams(window.location.search);
-    return {fpath: tmp.get('filepath'), port: tmp.get('port') ?? '9877'}
+    // With follow=false, we stick to our document instead of switching to
+    // whatever document is piped to pmpm
+    return {fpath: tmp.get('filepath'), port: tmp.get('port') ?? '9877',
+            followPipe: tmp.get('follow') !== 'false'}
 })());
 
 
@@ -310,6 +313,79 @@ function scrollToFirstChange(scrollTarget, scrollTargetCompare)
     window.scrollTo({top: newpos});
 }
 
+// Viewport-first rendering: we report which blocks are visible, the server
+// renders them first and sends placeholders for the other blocks (partial)
+let reportViewport = true;
+let _lastViewport;
+let _viewportTimeout;
+let _partialShown = false;
+function isPlaceholder(el)
+{
+    return el.firstElementChild?.classList.contains('pmpm-placeholder') ?? false;
+}
+
+function firstVisibleBlock()
+{
+    // binary search for the first block reaching into the window
+    let lo = 0, hi = children.length;
+    while(lo < hi) {
+        const mid = (lo + hi) >> 1;
+        if(children[mid].getBoundingClientRect().bottom <= 0)
+            lo = mid + 1;
+        else
+            hi = mid;
+    }
+    return lo;
+}
+
+function sendViewport()
+{
+    _viewportTimeout = undefined;
+    if(!reportViewport || !_websocket || _websocket.readyState !== WebSocket.OPEN)
+        return;
+    const first = firstVisibleBlock();
+    let last = first;
+    while(last + 1 < children.length && children[last+1].getBoundingClientRect().top < window.innerHeight)
+        last++;
+    const viewport = first + ':' + last;
+    if(viewport !== _lastViewport) {
+        _lastViewport = viewport;
+        _websocket.send('viewport:' + viewport);
+    }
+}
+
+function scheduleSendViewport()
+{
+    if(_viewportTimeout === undefined)
+        _viewportTimeout = setTimeout(sendViewport, 200);
+}
+
+function scrollAnchor()
+{
+    const el = children[firstVisibleBlock()];
+    return el && {el: el, top: el.getBoundingClientRect().top};
+}
+
+function restoreScrollAnchor(anchor)
+{
+    if(anchor.el.isConnected)
+        window.scrollBy(0, anchor.el.getBoundingClientRect().top - anchor.top);
+}
+
+// Reload local files (e.g. images) that changed on disk, bypassing the browser cache
+function reloadAssets(urls)
+{
+    const stamp = '?pmpm=' + Date.now();
+    const elements = container.querySelectorAll('[src^="file://"]');
+    for(const url of urls) {
+        for(const el of elements) {
+            const src = el.getAttribute('src');
+            if(src === url || src.startsWith(url + '?pmpm='))
+                el.setAttribute('src', url + stamp);
+        }
+    }
+}
+
 // Load local links to .md files directly in this pmpm instance
 // called for local src/href attributes, see websocket.py
 function localLinkClickEvent(el)
@@ -540,8 +616,9 @@ function citeprocResultEvent(html, bibid)
     _lastCiteprocHtml = html;
     _lastCiteprocBibid = bibid;
 
-    if(_lastCiteprocBibid == contentBibid) {
+    if(_lastCiteprocBibid == contentBibid && !_partialShown) {
         // Citeproc result is for htmlblocks that we have already loaded
+        // (citations are matched by position, so not while blocks are missing)
         updateRefsFromCiteprocResult();
     } else {
         // Citeproc result is for htmlblocks that is either already gone or not yet loaded
@@ -553,12 +630,19 @@ const _textcitesCache = {};
 let _refsElement;
 let _citeprocDoneResolve;
 let _citeprocDoneReject;
-function updateBodyFromBlocks(contentnew, referenceSectionTitle)
+function updateBodyFromBlocks(contentnew, referenceSectionTitle, partial)
 {
+    // While the server fills in the blocks around the blocks rendered first,
+    // keep the content the user is looking at in place
+    const anchor = _partialShown ? scrollAnchor() : undefined;
+    _partialShown = partial;
+
     // Go through new content blocks. At each step we ensure that <div id="content"> matches the new contents up to block i
     let i;
     let firstChange;
     let firstChangeCompare;
+    let scrollTarget;
+    let scrollTargetCompare;
     let mustRenumber = false;
     let renumberNum;
     const renderPromises = [];
@@ -589,9 +673,14 @@ function updateBodyFromBlocks(contentnew, referenceSectionTitle)
                     firstChange = children[i];
                     firstChangeCompare = children[j];
                 }
+                if (scrollTarget === undefined) {
+                    scrollTarget = children[i];
+                    scrollTargetCompare = children[j];
+                }
             }
         } else {
             // Hash does not exist, creating new
+            const fillsPlaceholder = i < children.length && isPlaceholder(children[i]);
             const newEl = document.createElement(wrappingTagName);
             newEl.setAttribute(hashAttr, newhash);
             newEl.innerHTML = contentnew[i][1];
@@ -615,6 +704,11 @@ function updateBodyFromBlocks(contentnew, referenceSectionTitle)
                 firstChange = children[i];
                 firstChangeCompare = children[i+1];
             }
+            // Placeholders, and blocks filling them in, are not worth scrolling to
+            if (scrollTarget === undefined && !isPlaceholder(newEl) && !fillsPlaceholder) {
+                scrollTarget = children[i];
+                scrollTargetCompare = children[i+1];
+            }
         }
 
         // Renumber footnotes if necessary
@@ -656,6 +750,9 @@ function updateBodyFromBlocks(contentnew, referenceSectionTitle)
         footnotes.removeChild(footnotes.lastElementChild);
     }
 
+    if(anchor !== undefined && scrollTarget === undefined)
+        restoreScrollAnchor(anchor);
+
     if (firstChange !== undefined) {
         // Show/hide footnotes
         const showFootnotes = footnotes.lastElementChild.start > 1 || footnotes.lastElementChild.childElementCount;
@@ -683,6 +780,19 @@ function updateBodyFromBlocks(contentnew, referenceSectionTitle)
 
     const blockRenderingPromise = Promise.all(renderPromises);
 
+    // More blocks will follow, the final message completes the toc and citeproc handling
+    if(partial) {
+        tocUpdated = false;
+        blockRenderingPromise.finally(() => {
+            if(scrollTarget !== undefined)
+                scrollToFirstChange(scrollTarget, scrollTargetCompare);
+            else if(anchor !== undefined)
+                restoreScrollAnchor(anchor);
+            scheduleSendViewport();
+        });
+        return;
+    }
+
     if(firstChange !== undefined) {
         blockRenderingPromise.finally(() => {
             // Update table of contents if toc is enabled and currently visible.
@@ -697,7 +807,11 @@ function updateBodyFromBlocks(contentnew, referenceSectionTitle)
             // scroll (first changed child of) first changed block into view
             // But only after rendering is finished. Otherwise the first change detection
             // may find a still-rendering but unchanged element.
-            scrollToFirstChange(firstChange, firstChangeCompare);
+            if(scrollTarget !== undefined)
+                scrollToFirstChange(scrollTarget, scrollTargetCompare);
+            else if(anchor !== undefined)
+                restoreScrollAnchor(anchor);
+            scheduleSendViewport();
         });
     } else {
         // Even if no html block is changed, we must update the toc if it
@@ -764,6 +878,48 @@ function hideStatus()
     status.style.display = 'none';
 }
 
+// Delta protocol: the server only sends the html of blocks we don't have yet
+const deltaProtocolVersion = 1;
+let blocksVersion = null;
+function blocksFromDelta(message)
+{
+    // The delta is relative to a version we don't have
+    if(message.base !== null && message.base !== blocksVersion)
+        return undefined;
+
+    const newblocks = new Map(message.newblocks);
+    const available = new Map();
+    for(const child of children) {
+        const hash = child.getAttribute(hashAttr);
+        available.set(hash, (available.get(hash) ?? 0) + 1);
+    }
+
+    const htmlblocks = [];
+    for(const hash of message.blockorder) {
+        if(!newblocks.has(hash)) {
+            // We must already have this block
+            const n = available.get(String(hash));
+            if(!n)
+                return undefined;
+            available.set(String(hash), n-1);
+        }
+        htmlblocks.push([hash, newblocks.get(hash)]);
+    }
+    return htmlblocks;
+}
+
+// Large messages are sent as deflated binary frames if we can inflate them
+const deflateSupported = typeof DecompressionStream !== 'undefined';
+const binaryFrameDeflate = 1;
+async function decodeBinaryFrame(blob)
+{
+    const format = new Uint8Array(await blob.slice(0, 1).arrayBuffer())[0];
+    if(format !== binaryFrameDeflate)
+        throw new Error('Unknown binary frame format '+format);
+    const stream = blob.slice(1).stream().pipeThrough(new DecompressionStream('deflate'));
+    return new Response(stream).text();
+}
+
 const websocketUrl = `ws://localhost:${port}/`;
 let _websocket;
 let _websocketResolve;
@@ -774,14 +930,37 @@ async function initWebsocket()
 {
     showStatusInfo('Connecting to '+websocketUrl+'...');
 
-    _websocket = new WebSocket(websocketUrl);
+    _websocket = new WebSocket(websocketUrl + (deflateSupported ? '?encoding=deflate' : ''));
+    // Decoding binary frames is async, keep messages in order nonetheless
+    let messageQueue = Promise.resolve();
     _websocket.onopen = function() {
+        blocksVersion = null;
+        _websocket.send('protocol:' + deltaProtocolVersion);
+        if(!followPipe)
+            _websocket.send('unfollow');
+        _lastViewport = undefined;
+        sendViewport();
         hideStatus();
         _websocketResolve();
     };
     _websocket.onmessage = function (event) {
+        const data = typeof event.data === 'string' ? event.data : decodeBinaryFrame(event.data);
+        messageQueue = messageQueue.then(() => data).then(handleMessage).catch(e => showStatusWarning(e.message));
+    };
+
+    const handleMessage = function (data) {
         // parse message
-        const message = JSON.parse(event.data);
+        const message = JSON.parse(data);
+
+        if(message.blockorder !== undefined) {
+            message.htmlblocks = blocksFromDelta(message);
+            if(message.htmlblocks === undefined) {
+                // Out of sync, request all htmlblocks
+                _websocket.send('resync');
+                return;
+            }
+            blocksVersion = message.version;
+        }
 
         if(message.htmlblocks !== undefined) {
             // update page
@@ -789,13 +968,18 @@ async function initWebsocket()
             tocTitleText = message["toc-title"] ?? tocTitleTextDefault;
             contentBibid = message.bibid;
             suppressBibliography = message["suppress-bibliography"];
-            updateBodyFromBlocks(message.htmlblocks, message["reference-section-title"]);
+            updateBodyFromBlocks(message.htmlblocks, message["reference-section-title"], message.partial === true);
         } else {
             if(message.bibid !== undefined) {
                 // Async citeproc result
                 citeprocResultEvent(message.html, message.bibid);
                 return;
             }
+            if(message.reload !== undefined) {
+                // local files changed on disk
+                reloadAssets(message.reload);
+                return;
+            }
             if(message.error !== undefined) {
                 // backend error
                 showStatusWarning(message.error);
@@ -816,6 +1000,8 @@ async function initWebsocket()
             const urlParams = new URLSearchParams({filepath: message.filepath});
             if(port != '9877')
                 urlParams.set('port', port);
+            if(!followPipe)
+                urlParams.set('follow', 'false');
             fpath = message.filepath;
             window.document.title = 'pmpm - '+fpath;
             history.pushState({fpath:fpath}, fpath, '?'+urlParams);
@@ -833,7 +1019,13 @@ async function initWebsocket()
                 _websocketResolve = resolve;
             });
             _websocket = null;
-            _websocketPromise.then(() => showStatusInfo('Just connected to '+websocketUrl+'. Shown content is possibly outdated. Pipe something to pmpm ;-)'));
+            _websocketPromise.then(() => {
+                // The server forgot which document we show
+                if(!followPipe && fpath)
+                    _websocket.send(fpathLoadMessagePrefix + fpath);
+                else
+                    showStatusInfo('Just connected to '+websocketUrl+'. Shown content is possibly outdated. Pipe something to pmpm ;-)');
+            });
             setTimeout(initWebsocket, 5000);
             showStatusWarning('Error connecting to '+websocketUrl+'. Retrying in 5 seconds...');
         }
@@ -846,6 +1038,9 @@ async function getWebsocket()
     return _websocket;
 }
 
+window.addEventListener('scroll', scheduleSendViewport, {passive: true});
+window.addEventListener('resize', scheduleSendViewport);
+
 window.onpopstate = function (event) {
 
     // Don't do anything on scroll to footnotes
@@ -866,8 +1061,11 @@ window.onpopstate = function (event) {
 function init(customWrappingTagName, customFpathLoadMessagePrefix)
 {
     // Custom wrapping tag name, for slides
-    if(customWrappingTagName !== undefined)
+    // Slides are not scrolled, thus there is no viewport to report
+    if(customWrappingTagName !== undefined) {
         wrappingTagName = customWrappingTagName;
+        reportViewport = false;
+    }
 
     // Custom fpath load message prefix, for slides
     if(customFpathLoadMessagePrefix !== undefined)
@@ -0,0 +1,164 @@
+"""
+index of bibliography files for citeproc
+
+pandoc --citeproc reads and parses all bibliography files on every run,
+which takes seconds for a large .bib file. BibliographyIndex converts each
+bibliography file to CSL JSON once per modification time, sessions citing
+the same file share the conversion. The citeproc runs then get a CSL JSON
+file with only the cited entries (including nocite, with @* all entries)
+instead.
+"""
+
+
+import asyncio
+from collections import OrderedDict
+import json
+from pathlib import Path
+import tempfile
+
+from .diskcache import cachekey
+
+
+# file extension -> pandoc input format, None for CSL JSON
+BIBFORMATS = {".bib": "biblatex",
+              ".bibtex": "bibtex",
+              ".json": None}
+
+# number of filtered bibliographies kept on disk
+MAX_FILTERED = 16
+
+
+def bibliography_files(bibliography, cwd):
+    """ the paths of the bibliography files
+
+    Args:
+        bibliography: the pandoc json metadata value of bibliography
+        cwd: the directory of the markdown file
+
+    """
+    if bibliography['t'] == 'MetaInlines':
+        return [cwd / bibliography['c'][0]['c']]
+    return [cwd / b['c'][0]['c'] for b in bibliography['c']]
+
+
+def citation_ids(jsonobj):
+    """ yield the ids of all citations in pandoc json """
+    if isinstance(jsonobj, dict):
+        if jsonobj.get("t") == "Cite":
+            for citation in jsonobj["c"][0]:
+                yield citation["citationId"]
+        else:
+            for v in jsonobj.values():
+                yield from citation_ids(v)
+    elif isinstance(jsonobj, list):
+        for item in jsonobj:
+            yield from citation_ids(item)
+
+
+class BibliographyIndex:
+
+    def __init__(self, directory, convert):
+        """
+        Args:
+            directory: where to write the filtered CSL JSON files
+            convert: coroutine function running a pandoc call on a text
+        """
+        self.directory = Path(directory)
+        self._convert = convert
+        # path -> (mtime, {id: CSL JSON entry})
+        self._entries = {}
+        # (path, mtime) -> task indexing the file
+        self._pending = {}
+        # filtered CSL JSON files, least recently used first
+        self._filtered = OrderedDict()
+
+    async def entries(self, path, mtime):
+        """ the entries of a bibliography file by id
+
+        Raises:
+            KeyError: if the bibliography format is not supported
+            OSError: if the file cannot be read
+
+        """
+        cached = self._entries.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        pending = self._pending.get((path, mtime))
+        if pending is None:
+            pending = self._pending[path, mtime] = asyncio.ensure_future(
+                self._index(path, mtime))
+            pending.add_done_callback(
+                lambda _: self._pending.pop((path, mtime), None))
+        # a cancelled render does not cancel the conversion for the others
+        return await asyncio.shield(pending)
+
+    async def _index(self, path, mtime):
+        bibformat = BIBFORMATS[path.suffix.lower()]
+        text = await asyncio.get_event_loop().run_in_executor(
+            None, path.read_text)
+        if bibformat is not None:
+            text = await self._convert(
+                ("pandoc", "--from", bibformat, "--to", "csljson"), text)
+        entries = {}
+        for entry in json.loads(text):
+            entries.setdefault(entry["id"], entry)
+        self._entries[path] = (mtime, entries)
+        return entries
+
+    async def filter(self, jsondump, cwd):
+        """ replace the bibliography of the citeproc input by the cited entries
+
+        Args:
+            jsondump: the citeproc input, see uniqueciteprocdict
+            cwd: the directory of the markdown file
+
+        Returns:
+            jsondump: the citeproc input, unchanged if any bibliography file
+                cannot be indexed
+
+        """
+        bibinfo = json.loads(jsondump)
+        bibliography = bibinfo['meta'].get('bibliography')
+        if not bibliography:
+            return jsondump
+        try:
+            indexed = [await self.entries(path, mtime)
+                       for path, mtime in zip(
+                           bibliography_files(bibliography, cwd),
+                           bibinfo['bibliography_mtimes_'])]
+        except (KeyError, OSError, ValueError):
+            return jsondump
+
+        ids = set(citation_ids(bibinfo['blocks']))
+        ids.update(citation_ids(bibinfo['meta'].get('nocite', [])))
+        selected = {}
+        for entries in indexed:
+            for i in (entries if "*" in ids else ids & entries.keys()):
+                selected.setdefault(i, entries[i])
+
+        key = cachekey(bibinfo['bibliography_mtimes_'],
+                       *(str(p) for p in bibliography_files(bibliography,
+                                                            cwd)),
+                       *sorted(selected))
+        path = self.directory / f"{key}.json"
+        if key not in self._filtered:
+            await asyncio.get_event_loop().run_in_executor(
+                None, self._write, path, list(selected.values()))
+        self._filtered[key] = path
+        self._filtered.move_to_end(key)
+        while len(self._filtered) > MAX_FILTERED:
+            try:
+                self._filtered.popitem(last=False)[1].unlink()
+            except FileNotFoundError:
+                pass
+
+        bibinfo['meta']['bibliography'] = {"t": "MetaString", "c": str(path)}
+        return json.dumps(bibinfo)
+
+    def _write(self, path, entries):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # concurrent writes of the same file each use their own temporary file
+        with tempfile.NamedTemporaryFile('w', dir=self.directory,
+                                         suffix=".tmp", delete=False) as f:
+            f.write(json.dumps(entries))
+        Path(f.name).replace(path)
@@ -0,0 +1,194 @@
+"""
+memory-bounded caches
+
+All caches share one CacheBudget of bytes. The size of each entry (key and
+value) is estimated when it is stored. When the budget is exceeded, entries
+are evicted by size-weighted LRU: of the least recently used entries of all
+caches, the one with the largest size times age is evicted first. Thus, a
+large md2json result is evicted before a small block that is somewhat older.
+
+Keys are fixed-size digests of the inputs rather than the inputs themselves,
+which would otherwise be kept in memory a second time, see digest.
+"""
+
+
+import asyncio
+import functools
+import hashlib
+import sys
+from collections import OrderedDict
+
+
+MISSING = object()
+
+
+def digest(*parts):
+    """ 16 byte blake2b digest of the str parts, as a compact cache key """
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.digest()
+
+
+def approxsize(obj):
+    """ approximate memory used by obj, including the objects it contains
+
+    Dict keys are not counted separately, since in pandoc's json they are
+    mostly the same few strings.
+    """
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+    return size
+
+
+class CacheBudget:
+    """ memory budget shared by several caches """
+
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.used = 0
+        self.caches = []
+        # incremented on every cache access, to compute the age of entries
+        self.tick = 0
+
+    def evict(self):
+        while self.used > self.maxbytes:
+            victim = max((c for c in self.caches if len(c)),
+                         key=lambda c: c.evictionscore(self.tick))
+            victim.popoldest()
+
+    def stats(self):
+        return {"bytes": self.used,
+                "maxbytes": self.maxbytes,
+                "caches": {c.name: c.stats() for c in self.caches}}
+
+
+class LRUCache:
+    """ least recently used cache with byte size accounting
+
+    Unlike alru_cache, the cache can be queried and filled explicitly, e.g. to
+    find out which blocks have to be rendered before calling pandoc at all.
+    """
+
+    def __init__(self, name, budget):
+        self.name = name
+        self._budget = budget
+        self._budget.caches.append(self)
+        # key -> [value, size, tick of last use]
+        self._data = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._budget.tick += 1
+        entry = self._data[key]
+        entry[2] = self._budget.tick
+        return entry[0]
+
+    def put(self, key, value):
+        self._remove(key)
+        self._budget.tick += 1
+        size = approxsize(key) + approxsize(value)
+        self._data[key] = [value, size, self._budget.tick]
+        self.bytes += size
+        self._budget.used += size
+        self._budget.evict()
+
+    def discard(self, key):
+        """ remove the entry of key, if any """
+        self._remove(key)
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+            self._budget.used -= entry[1]
+
+    def evictionscore(self, now):
+        _, size, tick = next(iter(self._data.values()))
+        return size * (now - tick + 1)
+
+    def popoldest(self):
+        self._remove(next(iter(self._data)))
+
+    def clear(self):
+        for key in list(self._data):
+            self._remove(key)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self._data),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitrate": self.hits / lookups if lookups else None}
+
+
+def cached(cache, key=None):
+    """ cache the results of a coroutine function, like alru_cache
+
+    Concurrent calls with the same arguments share one evaluation. If the
+    call evaluating is cancelled, the others evaluate again. All callers get
+    the same value object, which they must not mutate.
+
+    Args:
+        key: function of the arguments returning the cache key, by default
+            the arguments themselves
+    """
+    def decorator(func):
+        pending = {}
+
+        @functools.wraps(func)
+        async def wrapper(*args):
+            k = args if key is None else key(*args)
+            value = cache.get(k, MISSING)
+            if value is not MISSING:
+                return value
+            while k in pending:
+                shared = pending[k]
+                try:
+                    return await asyncio.shield(shared)
+                except asyncio.CancelledError:
+                    if not shared.cancelled():
+                        raise
+            future = pending[k] = asyncio.get_event_loop().create_future()
+            try:
+                value = await func(*args)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except BaseException as e:
+                future.set_exception(e)
+                # mark as retrieved, the caller gets the exception anyway
+                future.exception()
+                raise
+            finally:
+                del pending[k]
+            cache.put(k, value)
+            future.set_result(value)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
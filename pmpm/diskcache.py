@@ -0,0 +1,113 @@
+"""
+persistent content-addressed cache of pandoc results
+
+Entries are stored as one file per key under DiskCache.directory, named by
+the sha256 digest of the key, so that cached results survive restarts of
+pmpm-websocket. Writes go to a temporary file that is atomically renamed,
+thus several pmpm-websocket processes can share the cache directory.
+
+When the cache grows beyond its maximum size, the least recently used
+entries are removed (hits update the modification time of the entry).
+All file system access happens in a background thread.
+"""
+
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import fcntl
+import hashlib
+import os
+from pathlib import Path
+
+
+def cachekey(*parts):
+    """ digest of the key parts, e.g. pandoc version, options, and input """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class DiskCache:
+
+    def __init__(self, directory, maxsize):
+        """
+        Args:
+            directory: where to store the entries
+            maxsize: maximum size of all entries in bytes
+        """
+        self.directory = Path(directory)
+        self.maxsize = maxsize
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        # bytes written since the size of the cache was last checked
+        self._written = maxsize
+
+    def _path(self, key):
+        return self.directory / key[:2] / key[2:]
+
+    def _get(self, keys):
+        values = []
+        for key in keys:
+            path = self._path(key)
+            try:
+                values.append(path.read_text())
+                os.utime(path)
+            except (FileNotFoundError, UnicodeDecodeError):
+                # not cached, or evicted by another process meanwhile
+                values.append(None)
+        return values
+
+    def _put(self, items):
+        for key, value in items:
+            path = self._path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f".{path.name}.{os.getpid()}")
+            tmp.write_text(value)
+            os.replace(tmp, path)
+            self._written += len(value)
+        if self._written > self.maxsize // 10:
+            self._evict()
+
+    def _evict(self):
+        self._written = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with (self.directory / "lock").open("w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # another process is evicting right now
+                return
+            entries = []
+            for path in self.directory.glob("??/*"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            size = sum(e[1] for e in entries)
+            entries.sort()
+            for mtime, entrysize, path in entries:
+                if size <= self.maxsize * 9 // 10:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                size -= entrysize
+
+    async def get(self, keys):
+        """ look up keys
+
+        Returns:
+            values: list of str or None for keys not in the cache
+
+        """
+        return await asyncio.get_event_loop().run_in_executor(
+            self._executor, self._get, keys)
+
+    def put(self, items):
+        """ store (key, value) items in the background """
+        if items:
+            asyncio.get_event_loop().run_in_executor(
+                self._executor, self._put, items)
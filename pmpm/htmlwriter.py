@@ -0,0 +1,208 @@
+"""
+in-process html writer for simple blocks, see pmpm-websocket --fast-writer
+
+Most blocks are paragraphs, headers, bullet lists, code blocks and rules made
+of plain text, emphasis, inline code and links. blocks2html renders these
+exactly like pandoc's html5 writer with --wrap=none does, without a pandoc
+call; for everything else, e.g. math, citations, images, raw html, tables
+and footnotes, it returns None and the blocks are left to pandoc.
+
+Since the output has to match pandoc's byte for byte, conformance checks
+whether blocks2html renders the blocks of CONFORMANCE_MARKDOWN like the
+pandoc at hand does; pmpm-websocket only uses blocks2html if it does, and
+bench/conformance.py compares the two on more documents. tests/golden holds
+pandoc's output for the samples and for each supported element.
+"""
+
+
+HTML_ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+# code blocks and attribute values are escaped by blaze, quotes included
+BLAZE_ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;",
+                               '"': "&quot;", "'": "&#39;"})
+# pandoc appends a variation selector to these, so that they are not
+# shown as emoji
+EMOJI_VARIATION_CHARS = frozenset("↩↔")
+
+INLINE_TAGS = {"Emph": "em",
+               "Underline": "u",
+               "Strong": "strong",
+               "Strikeout": "del",
+               "Superscript": "sup",
+               "Subscript": "sub"}
+QUOTES = {"SingleQuote": ("‘", "’"),
+          "DoubleQuote": ("“", "”")}
+# task list items are rendered with checkboxes
+TASK_MARKERS = ("☐", "☒")
+
+CONFORMANCE_MARKDOWN = """\
+# A header {#the-id .a-class .another}
+
+## Emphasis, *strong* and `code`
+
+A paragraph with *emphasis*, **strong emphasis**, ~~struck out~~,
+^super^script, ~sub~script, [small caps]{.smallcaps}, [underlined]{.ul}
+and `inline <code> & "quotes"`.
+
+Special characters: < > & " ' and "smart quotes" in 'single quotes',
+dashes -- and --- and an ellipsis...\\
+after a line break.
+
+A [link](https://example.com/?a=1&b=2 "its title"), a [relative
+link](notes/other.md), a [link to a header](#the-id) and an
+<https://example.com> autolink.
+
+- a tight
+- bullet list
+    - nested
+    - list
+
+- a loose
+
+- bullet list
+
+    with two paragraphs
+
+```
+a code block <with> & "quotes" and 'apostrophes'
+    indented
+```
+
+---
+
+###### Level six
+"""
+
+
+class Unsupported(Exception):
+    """ the blocks contain elements blocks2html does not render """
+
+
+def blocks2html(blocks):
+    """ the html of the blocks, or None if they are not supported
+
+    Args:
+        blocks: list of pandoc json blocks
+
+    Returns:
+        html: str: as pandoc writes it to stdout, or None
+
+    """
+    try:
+        return "\n".join(block(b) for b in blocks) + "\n"
+    except Unsupported:
+        return None
+
+
+def conformance(blocks, htmls):
+    """ yield the blocks blocks2html renders differently from pandoc
+
+    Args:
+        blocks: list of pandoc json blocks
+        htmls: the html pandoc renders each of the blocks to
+
+    Yields:
+        (block, pandoc's html, blocks2html's html)
+
+    """
+    for b, html in zip(blocks, htmls):
+        fast = blocks2html([b])
+        if fast is not None and fast != html:
+            yield b, html, fast
+
+
+def text(s):
+    if not EMOJI_VARIATION_CHARS.isdisjoint(s):
+        raise Unsupported
+    return s.translate(HTML_ESCAPES)
+
+
+def attributes(attr, classfirst=False):
+    """ the html attributes of a pandoc attr without key-value pairs
+
+    Args:
+        classfirst: write the class before the id, as pandoc 3 does for
+            headers
+    """
+    ident, classes, keyvalues = attr
+    if keyvalues:
+        raise Unsupported
+    idattr = classattr = ""
+    if ident:
+        idattr = f' id="{ident.translate(BLAZE_ESCAPES)}"'
+    if classes:
+        classattr = f' class="{" ".join(classes).translate(BLAZE_ESCAPES)}"'
+    return classattr + idattr if classfirst else idattr + classattr
+
+
+def block(b):
+    t, c = b["t"], b.get("c")
+    if t == "Para":
+        return f"<p>{inlines(c)}</p>"
+    if t == "Plain":
+        return inlines(c)
+    if t == "Header":
+        level, attr, content = c
+        if level > 6:
+            raise Unsupported
+        return (f"<h{level}{attributes(attr, classfirst=True)}>"
+                f"{inlines(content)}</h{level}>")
+    if t == "BulletList":
+        return "<ul>\n" + "".join(f"<li>{listitem(item)}</li>\n"
+                                  for item in c) + "</ul>"
+    if t == "CodeBlock":
+        attr, code = c
+        if attr != ["", [], []]:
+            # pandoc highlights code blocks with a language
+            raise Unsupported
+        return f"<pre><code>{code.translate(BLAZE_ESCAPES)}</code></pre>"
+    if t == "HorizontalRule":
+        return "<hr />"
+    raise Unsupported
+
+
+def listitem(blocks):
+    if blocks and blocks[0]["t"] in ("Plain", "Para"):
+        first = blocks[0]["c"][:1]
+        if first and first[0]["t"] == "Str" and first[0]["c"] in TASK_MARKERS:
+            raise Unsupported
+    return "\n".join(block(b) for b in blocks)
+
+
+def inlines(content):
+    if not content:
+        # pandoc omits empty paragraphs
+        raise Unsupported
+    return "".join(inline(i) for i in content)
+
+
+def inline(i):
+    t, c = i["t"], i.get("c")
+    if t == "Str":
+        return text(c)
+    if t in ("Space", "SoftBreak"):
+        return " "
+    if t == "LineBreak":
+        return "<br />\n"
+    if t in INLINE_TAGS:
+        tag = INLINE_TAGS[t]
+        return f"<{tag}>{inlines(c)}</{tag}>"
+    if t == "SmallCaps":
+        return f'<span class="smallcaps">{inlines(c)}</span>'
+    if t == "Quoted":
+        left, right = QUOTES[c[0]["t"]]
+        return f"{left}{inlines(c[1])}{right}"
+    if t == "Code":
+        attr, code = c
+        if attr != ["", [], []]:
+            raise Unsupported
+        return f"<code>{text(code)}</code>"
+    if t == "Link":
+        attr, content, (url, title) = c
+        if url.startswith("mailto:"):
+            # subject to --email-obfuscation
+            raise Unsupported
+        html = f'<a href="{url.translate(BLAZE_ESCAPES)}"{attributes(attr)}'
+        if title:
+            html += f' title="{title.translate(BLAZE_ESCAPES)}"'
+        return f"{html}>{inlines(content)}</a>"
+    raise Unsupported
@@ -0,0 +1,154 @@
+"""
+split markdown into top-level chunks that can be parsed independently
+
+A chunk boundary is a blank line after which pandoc starts a new top-level
+block no matter what came before. Constructs that reach across blank lines
+(fenced code and divs, lists, indented code, multiline tables, tables with
+captions) are kept within one chunk. Documents with constructs that make the
+parse of one chunk depend on other chunks (YAML metadata, title blocks,
+reference link definitions, implicit header references, footnotes, example
+lists, latex macros, raw html and tex blocks) are not split at all.
+"""
+
+
+import re
+
+
+# The document cannot be split if any of these is found
+UNSPLITTABLE = re.compile(
+    r"\A%"  # pandoc title block
+    r"|(?:\A|\n[ \t]*\n)---[ \t]*\n(?![ \t]*\n)"  # YAML metadata block
+    r"|^ {0,3}\[[^\]\n]+\]:"  # reference link and footnote definitions
+    r"|\[\^"  # footnote references
+    r"|\(@[\w-]*\)"  # example lists
+    r"|\\(?:re)?new(?:command|environment)|\\def\b"  # latex macros
+    r"|^ {0,3}(?:<(?!!--.*-->[ \t]*$)|\\begin\{)",  # raw html and tex blocks
+    re.MULTILINE)
+
+# A chunk cannot start with a line continuing the previous block
+CONTINUATION = re.compile(
+    r"[ \t]"  # indented code, list item continuation
+    r"|[-+*:~|][ \t]"  # list items, definitions, captions, line blocks
+    r"|(?:\d+|#|[a-zA-Z]|[ivxlcdmIVXLCDM]+)[.)][ \t]"  # ordered lists
+    r"|\((?:\d+|#|[a-zA-Z]|[ivxlcdmIVXLCDM]+)\)[ \t]"
+    r"|Table:")
+
+FENCE = re.compile(r" {0,3}(`{3,}|~{3,}|:{3,})(.*)")
+
+# the first, header separating and last lines of multiline tables
+TABLEDASHES = re.compile(r"-{3,}[- ]*$")
+# table captions, which may also precede the table
+CAPTION = re.compile(r"(?:Table)?:[ \t]")
+
+# [text] links to a header with that text (implicit_header_references)
+BRACKETED = re.compile(r"\[([^\[\]]+)\]")
+
+ATXHEADER = re.compile(r" {0,3}#{1,6}[ \t]+(.*?)[ \t#]*$")
+SETEXTUNDERLINE = re.compile(r"(?:=+|-+)[ \t]*$")
+
+
+def markdown_chunks(content):
+    """ split markdown into independently parseable chunks
+
+    Args:
+        content: the markdown string to split
+
+    Returns:
+        chunks: list of str joining to content, or None if content cannot be
+            split safely
+
+    """
+    if UNSPLITTABLE.search(content):
+        return None
+
+    chunks = []
+    headers = set()
+    start = 0
+    fence = None
+    divs = 0
+    table = False
+    caption = False
+    blank = False
+    previous = ""
+    pos = 0
+    lines = content.splitlines(keepends=True)
+    for k, line in enumerate(lines):
+        stripped = line.rstrip("\n")
+        m = FENCE.match(stripped)
+        closingdiv = m and m.group(1)[0] == ":" and not m.group(2).strip()
+
+        if not stripped.strip():
+            blank = True
+        else:
+            if (blank and fence is None and divs == 0 and pos > start
+                    and not table and not caption and not closingdiv
+                    and not CONTINUATION.match(stripped)):
+                chunks.append(content[start:pos])
+                start = pos
+            if blank or k == 0:
+                # a caption before a table belongs to it
+                caption = bool(CAPTION.match(stripped))
+            blank = False
+
+            # keep multiline tables, whose rows are separated by blank
+            # lines, in one chunk
+            if fence is None and TABLEDASHES.match(stripped):
+                following = lines[k + 1].strip() if k + 1 < len(lines) else ""
+                if table:
+                    table = bool(following)
+                elif not previous.strip() and following:
+                    table = True
+
+            # the auto identifiers of headers with the same text depend on
+            # the whole document
+            header = None
+            if fence is None:
+                header = ATXHEADER.match(stripped)
+                if header is None and SETEXTUNDERLINE.match(stripped):
+                    header = re.match(r"(.*\S)", previous)
+            if header is not None:
+                if header.group(1) in headers:
+                    return None
+                headers.add(header.group(1))
+
+        # keep fenced code blocks and fenced divs in one chunk
+        if fence is not None:
+            if (m and m.group(1)[0] == fence[0]
+                    and len(m.group(1)) >= len(fence)
+                    and not m.group(2).strip()):
+                fence = None
+        elif closingdiv:
+            divs = max(divs - 1, 0)
+        elif m and m.group(1)[0] == ":":
+            divs += 1
+        elif m:
+            fence = m.group(1)
+
+        previous = stripped
+        pos += len(line)
+
+    if fence is not None or divs:
+        return None
+    if headers and not {reference_text(r) for r in BRACKETED.findall(content)
+                        }.isdisjoint(reference_text(h) for h in headers):
+        return None
+    chunks.append(content[start:])
+    return chunks
+
+
+def reference_text(text):
+    """ text as matched by implicit header references """
+    return " ".join(text.split()).lower()
+
+
+def has_unique_header_ids(blocks):
+    """ whether the auto identifiers are the same as in a whole-document parse
+
+    pandoc appends -1, -2, ... to the identifiers of headers with the same
+    identifier, which does not happen across independently parsed chunks.
+    """
+    ids = [b["c"][1][0] for b in blocks if b["t"] == "Header"]
+    unique = set(ids)
+    if len(ids) != len(unique):
+        return False
+    return not any(re.sub(r"-\d+$", "", i) in unique - {i} for i in ids)
@@ -0,0 +1,200 @@
+"""
+tracking of files the rendered documents depend on, using inotify
+
+FileTracker keeps the modification times of files such as bibliographies,
+CSL styles and images up to date via inotify, instead of calling stat on
+every render, and reports changed files. Since editors often save by
+replacing a file, the parent directories are watched rather than the files.
+
+inotify is used via ctypes; where it is not available (not Linux),
+FileTracker falls back to stat and does not report changes.
+"""
+
+
+import asyncio
+import ctypes
+import os
+from pathlib import Path
+import struct
+
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_ONLYDIR)
+
+# struct inotify_event without the name
+EVENT = struct.Struct("iIII")
+
+# changes reported within this many seconds are reported together
+COALESCE_DELAY = .05
+
+
+class Inotify:
+    """ minimal inotify binding """
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self._libc.inotify_add_watch.argtypes = (
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._libc.inotify_rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        return wd
+
+    def rm_watch(self, wd):
+        # fails if the directory is gone already, which is fine
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """ yield the pending events as (wd, mask, name) """
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, pos)
+            pos += EVENT.size
+            name = data[pos:pos + length].rstrip(b"\0")
+            pos += length
+            yield wd, mask, os.fsdecode(name)
+
+
+class FileTracker:
+
+    def __init__(self, onchange):
+        """
+        Args:
+            onchange: function called with the set of changed files
+        """
+        self._onchange = onchange
+        # path as given -> resolved path
+        self._resolved = {}
+        # resolved path -> mtime, or None if the file does not exist
+        self._mtimes = {}
+        # watch descriptor <-> watched directory
+        self._dirs = {}
+        self._wds = {}
+        self._pending = set()
+        self._scheduled = False
+        try:
+            self._inotify = Inotify()
+        except OSError:
+            self._inotify = None
+        else:
+            asyncio.get_event_loop().add_reader(self._inotify.fd,
+                                                self._readevents)
+
+    def track(self, path):
+        """ track the file path
+
+        Returns:
+            path: the resolved path, as passed to onchange
+
+        """
+        resolved = self._resolved.get(path)
+        if resolved is None:
+            resolved = self._resolved[path] = Path(path).resolve()
+        if resolved not in self._mtimes and self._watch(resolved.parent):
+            self._mtimes[resolved] = self._stat(resolved)
+        return resolved
+
+    def untrack(self, path):
+        """ stop tracking the resolved path, and watching its directory if
+        no other tracked file is in it """
+        self._mtimes.pop(path, None)
+        for given in [g for g, r in self._resolved.items() if r == path]:
+            del self._resolved[given]
+        directory = path.parent
+        if (directory in self._wds
+                and not any(p.parent == directory for p in self._mtimes)):
+            wd = self._wds.pop(directory)
+            del self._dirs[wd]
+            self._inotify.rm_watch(wd)
+
+    def mtime(self, path):
+        """ the modification time of the file path, tracked from now on
+
+        Raises:
+            FileNotFoundError: if the file does not exist
+
+        """
+        resolved = self.track(path)
+        if resolved not in self._mtimes:
+            # cannot be watched
+            return resolved.stat().st_mtime
+        mtime = self._mtimes[resolved]
+        if mtime is None:
+            raise FileNotFoundError(f"No such file: '{path}'")
+        return mtime
+
+    @staticmethod
+    def _stat(path):
+        try:
+            return path.stat().st_mtime
+        except OSError:
+            return None
+
+    def _watch(self, directory):
+        if self._inotify is None:
+            return False
+        if directory not in self._wds:
+            try:
+                wd = self._inotify.add_watch(directory, WATCH_MASK)
+            except OSError:
+                return False
+            self._dirs[wd] = directory
+            self._wds[directory] = wd
+        return True
+
+    def _readevents(self):
+        for wd, mask, name in self._inotify.read_events():
+            directory = self._dirs.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                # the directory is gone, watch it again when tracked again
+                del self._dirs[wd], self._wds[directory]
+                for path in [p for p in self._mtimes if p.parent == directory]:
+                    del self._mtimes[path]
+                    self._pending.add(path)
+            elif directory / name in self._mtimes:
+                self._pending.add(directory / name)
+            else:
+                continue
+            if not self._scheduled:
+                self._scheduled = True
+                asyncio.get_event_loop().call_later(COALESCE_DELAY,
+                                                    self._report)
+
+    def _report(self):
+        self._scheduled = False
+        changed = set()
+        for path in self._pending:
+            mtime = self._stat(path)
+            if path not in self._mtimes or self._mtimes[path] != mtime:
+                changed.add(path)
+                if path in self._mtimes:
+                    self._mtimes[path] = mtime
+        self._pending = set()
+        if changed:
+            self._onchange(changed)
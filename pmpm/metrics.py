@@ -0,0 +1,100 @@
+"""
+latency histograms and counters
+
+Metrics collects where the time goes between content arriving and the
+htmlblocks reaching the clients: the durations of the pandoc stages and of
+sending, in histograms with exponential buckets, and counters, e.g. of pandoc
+processes started. pmpm-websocket serves them together with the cache
+statistics at http://127.0.0.1:PORT/status, see `pmpm --status`.
+"""
+
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import functools
+import time
+
+
+# upper bounds of the histogram buckets in seconds, 1ms to about 1min
+BUCKETS = tuple(.001 * 2 ** k for k in range(17))
+
+
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # the last count is of values above all buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """ the upper bound of the bucket of the q-quantile, or None """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def stats(self):
+        return {"count": self.count,
+                "mean": self.sum / self.count if self.count else None,
+                "p50": self.quantile(.5),
+                "p90": self.quantile(.9),
+                "p99": self.quantile(.99),
+                "max": self.max,
+                "buckets": dict(zip(self.buckets, self.counts)),
+                "above": self.counts[-1]}
+
+
+class Metrics:
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, seconds):
+        """ add seconds to the histogram name """
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        self.histograms[name].observe(seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, name):
+        """ add the time spent in the block to the histogram name, unless
+        it raises, e.g. when cancelled """
+        start = time.perf_counter()
+        yield
+        self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """ decorator adding the durations of a coroutine function to the
+        histogram name """
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        return {"uptime": time.time() - self.started,
+                "latency": {k: h.stats()
+                            for k, h in sorted(self.histograms.items())},
+                "counters": dict(sorted(self.counters.items()))}
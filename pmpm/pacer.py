@@ -0,0 +1,95 @@
+"""
+adaptive pacing of renders
+
+After each render, processqueue waits before it takes the next content from
+the queue, so that content piped in meanwhile is coalesced into one render.
+Pacer chooses this delay from exponentially weighted moving averages of the
+render durations and of the intervals between inputs:
+
+- input arriving slower than it is rendered is rendered right away
+  (after mindelay), e.g. small documents or occasional saves
+- input arriving faster than it is rendered, e.g. an editor piping a large
+  document on every keystroke, waits about as long as a render takes, but at
+  most maxdelay, since rendering every single input would only fall behind
+
+Renders superseded by new input count as lasting at least as long as they
+ran. After patience superseded renders in a row, new input no longer cancels
+the render in progress, so that the preview is updated while typing steadily.
+"""
+
+
+import time
+
+
+class Pacer:
+
+    def __init__(self, mindelay, maxdelay, weight=.3, patience=1):
+        """
+        Args:
+            mindelay: minimum delay between renders in seconds
+            maxdelay: maximum delay between renders in seconds
+            weight: weight of the latest sample in the moving averages
+            patience: number of renders in a row new input may cancel
+        """
+        self.mindelay = mindelay
+        self.maxdelay = maxdelay
+        self.weight = weight
+        self.patience = patience
+        self.duration = None
+        self.interval = None
+        # renders superseded in a row
+        self.superseded = 0
+        self._lastinput = None
+
+    def _average(self, average, sample):
+        if average is None:
+            return sample
+        return self.weight * sample + (1 - self.weight) * average
+
+    def input(self):
+        """ record the arrival of new content """
+        now = time.monotonic()
+        if self._lastinput is not None:
+            # a pause ends a burst of input quickly
+            interval = min(now - self._lastinput, 10 * self.maxdelay)
+            self.interval = self._average(self.interval, interval)
+        self._lastinput = now
+
+    def rendered(self, duration):
+        """ record the duration of a completed render in seconds """
+        self.duration = self._average(self.duration, duration)
+        self.superseded = 0
+
+    def cancelled(self, elapsed):
+        """ record a render superseded by new input after elapsed seconds """
+        # it would have taken at least that long
+        if self.duration is None or elapsed > self.duration:
+            self.duration = self._average(self.duration, elapsed)
+        self.superseded += 1
+
+    def supersede(self):
+        """ whether new input may cancel the render in progress """
+        return self.superseded < self.patience
+
+    def delay(self):
+        """ the delay before the next render in seconds """
+        if self.duration is None or not (
+                self.superseded
+                or self.interval is not None
+                and self.interval < self.duration):
+            return self.mindelay
+        return min(max(self.duration, self.mindelay), self.maxdelay)
+
+    def tick(self):
+        """ the interval of progress updates during a render in seconds """
+        if self.duration is None:
+            return .3
+        return min(max(self.duration / 8, .1), 1)
+
+    def stats(self):
+        return {"delay": self.delay(),
+                "mindelay": self.mindelay,
+                "maxdelay": self.maxdelay,
+                "render-duration": self.duration,
+                "superseded": self.superseded,
+                "input-interval": self.interval}
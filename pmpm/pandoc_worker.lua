@@ -0,0 +1,48 @@
+-- pmpm pandoc worker, run as `pandoc lua pandoc_worker.lua`
+--
+-- Reads conversion requests from stdin, one after the other. Each request is
+-- a header line
+--     from \t to \t standalone (0|1) \t math \t slidelevel \t wrap \t length
+-- followed by length bytes of input. Each response is a line
+--     ok|error \t length
+-- followed by length bytes of output.
+
+local templates = {}
+
+local function convert (from, to, standalone, math, slidelevel, wrap, text)
+  local opts = {wrap_text = 'wrap-' .. wrap}
+  if math ~= 'plain' then
+    opts.html_math_method = math
+  end
+  if slidelevel > 0 then
+    opts.slide_level = slidelevel
+  end
+  if standalone then
+    if not templates[to] then
+      templates[to] = pandoc.template.compile(pandoc.template.default(to))
+    end
+    opts.template = templates[to]
+  end
+  local out = pandoc.write(pandoc.read(text, from), to, opts)
+  -- pandoc appends a newline when writing to stdout, so do we
+  if out:sub(-1) ~= '\n' then
+    out = out .. '\n'
+  end
+  return out
+end
+
+io.stdout:setvbuf('full')
+while true do
+  local header = io.read('l')
+  if not header then
+    break
+  end
+  local from, to, standalone, math, slidelevel, wrap, length = header:match(
+    '^(%S+)\t(%S+)\t([01])\t(%S+)\t(%d+)\t(%a+)\t(%d+)$')
+  local text = tonumber(length) > 0 and io.read(tonumber(length)) or ''
+  local ok, out = pcall(convert, from, to, standalone == '1', math,
+                        tonumber(slidelevel), wrap, text)
+  out = tostring(out)
+  io.write(ok and 'ok' or 'error', '\t', #out, '\n', out)
+  io.flush()
+end
@@ -0,0 +1,295 @@
+"""
+pool of warm, long-lived pandoc workers
+
+Starting pandoc is slow compared to converting a single block. Instead of
+starting one pandoc process per conversion, PandocPool keeps a few pandoc
+processes running and multiplexes the conversions over them.
+
+Two kinds of workers are available:
+
+LuaWorker:
+    `pandoc lua` running pandoc_worker.lua, which reads requests from stdin
+    and writes the converted documents to stdout (pandoc >= 3.0)
+ServerWorker:
+    `pandoc-server` listening on a local port, requests are sent via http
+    (pandoc >= 3.0)
+
+Only conversions that need no access to the file system can be sent to the
+workers; PandocPool.run raises PandocPoolError for all other pandoc calls and
+when a worker crashes, so that the caller can fall back to a subprocess.
+PandocPool.start raises it if the workers do not work at all, e.g. with
+pandoc < 3.0.
+"""
+
+
+import asyncio
+import json
+import socket
+
+from .utils import BASE_DIR
+
+
+HEALTH_CHECK_INTERVAL = 30
+
+
+class PandocPoolError(Exception):
+    pass
+
+
+def pandoc_request(args):
+    """ translate pandoc command line arguments to a worker request
+
+    Args:
+        args: the pandoc call, e.g. ("pandoc", "--from", "json", "--mathml")
+
+    Returns:
+        request: dict with keys from, to, standalone, math, slidelevel, wrap
+
+    Raises:
+        PandocPoolError: if the call cannot be handled by a worker
+
+    """
+    request = {"from": "markdown", "to": "html5", "standalone": False,
+               "math": "plain", "slidelevel": 0, "wrap": "auto"}
+    args = iter(args[1:])
+    for arg in args:
+        if arg in ("--from", "--to"):
+            request[arg[2:]] = next(args)
+        elif arg == "--slide-level":
+            request["slidelevel"] = int(next(args))
+        elif arg == "--standalone":
+            request["standalone"] = True
+        elif arg in ("--mathml", "--katex"):
+            request["math"] = arg[2:]
+        elif arg.startswith("--wrap="):
+            request["wrap"] = arg[7:]
+        else:
+            raise PandocPoolError(f"unsupported pandoc argument {arg}")
+    return request
+
+
+class LuaWorker:
+
+    def __init__(self):
+        self._proc = None
+
+    async def start(self):
+        self._proc = await asyncio.subprocess.create_subprocess_exec(
+            "pandoc", "lua", str(BASE_DIR / "pandoc_worker.lua"),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL)
+
+    async def stop(self):
+        if self._proc is not None and self._proc.returncode is None:
+            self._proc.kill()
+            await self._proc.wait()
+
+    @property
+    def pid(self):
+        return self._proc.pid if self._proc is not None else None
+
+    async def run(self, request, text):
+        if self._proc is None or self._proc.returncode is not None:
+            raise PandocPoolError("pandoc worker is not running")
+        data = text.encode()
+        header = "\t".join((request["from"],
+                            request["to"],
+                            "1" if request["standalone"] else "0",
+                            request["math"],
+                            str(request["slidelevel"]),
+                            request["wrap"],
+                            str(len(data))))
+        try:
+            self._proc.stdin.write(header.encode() + b"\n" + data)
+            await self._proc.stdin.drain()
+            status, length = (await self._proc.stdout.readline()).split()
+            out = await self._proc.stdout.readexactly(int(length))
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            raise PandocPoolError("pandoc worker died")
+        if status != b"ok":
+            raise PandocPoolError(out.decode())
+        return out.decode()
+
+    async def healthy(self):
+        try:
+            return await self.run(pandoc_request(("pandoc", "--to", "json")),
+                                  "") != ""
+        except PandocPoolError:
+            return False
+
+
+class ServerWorker:
+
+    def __init__(self):
+        self._proc = None
+        self._port = None
+
+    async def start(self):
+        # let the os pick a free port
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self._port = s.getsockname()[1]
+        self._proc = await asyncio.subprocess.create_subprocess_exec(
+            "pandoc-server", "--port", str(self._port),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL)
+        # wait for pandoc-server to listen
+        for _ in range(50):
+            if await self.healthy():
+                return
+            await asyncio.sleep(.1)
+
+    async def stop(self):
+        if self._proc is not None and self._proc.returncode is None:
+            self._proc.kill()
+            await self._proc.wait()
+
+    @property
+    def pid(self):
+        return self._proc.pid if self._proc is not None else None
+
+    async def _http(self, method, path, body=b""):
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1",
+                                                           self._port)
+        except OSError:
+            raise PandocPoolError("pandoc-server not reachable")
+        try:
+            # http/1.0 avoids chunked responses
+            writer.write(f"{method} {path} HTTP/1.0\r\n"
+                         "Host: localhost\r\n"
+                         "Content-Type: application/json\r\n"
+                         "Accept: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\n"
+                         "Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+            response = await reader.read()
+        except ConnectionError:
+            raise PandocPoolError("pandoc-server died")
+        finally:
+            writer.close()
+        head, _, body = response.partition(b"\r\n\r\n")
+        if head.split(b" ", 2)[1:2] != [b"200"]:
+            raise PandocPoolError(body.decode(errors="replace"))
+        return body
+
+    async def run(self, request, text):
+        if self._proc is None or self._proc.returncode is not None:
+            raise PandocPoolError("pandoc-server is not running")
+        options = {"text": text,
+                   "from": request["from"],
+                   "to": request["to"],
+                   "standalone": request["standalone"]}
+        if request["math"] != "plain":
+            options["html-math-method"] = request["math"]
+        if request["slidelevel"]:
+            options["slide-level"] = request["slidelevel"]
+        if request["wrap"] != "auto":
+            options["wrap"] = request["wrap"]
+        body = await self._http("POST", "/", json.dumps(options).encode())
+        try:
+            out = json.loads(body)["output"]
+        except (ValueError, KeyError):
+            raise PandocPoolError("invalid pandoc-server response")
+        # pandoc appends a newline when writing to stdout, so do we
+        return out if out.endswith("\n") else out + "\n"
+
+    async def healthy(self):
+        if self._proc is None or self._proc.returncode is not None:
+            return False
+        try:
+            await self._http("GET", "/version")
+        except PandocPoolError:
+            return False
+        return True
+
+
+WORKERS = {"lua": LuaWorker, "server": ServerWorker}
+
+
+class PandocPool:
+    """ pool of warm pandoc workers
+
+    Each worker converts one document at a time; run waits for an idle worker.
+    Crashed workers are replaced, idle workers are health checked regularly.
+    """
+
+    def __init__(self, kind, size):
+        self._worker = WORKERS[kind]
+        self._size = size
+        self._idle = asyncio.Queue()
+        # all running workers, idle or not
+        self._workers = set()
+        self._healthchecks = None
+
+    async def start(self):
+        """ start the workers
+
+        Raises:
+            PandocPoolError: if the first worker does not work, e.g. because
+                pandoc is older than 3.0 -- use pandoc subprocesses instead
+
+        """
+        try:
+            worker = await self._start_worker()
+        except OSError as e:
+            raise PandocPoolError(f"cannot start pandoc worker: {e}")
+        if not await worker.healthy():
+            self._workers.discard(worker)
+            await worker.stop()
+            raise PandocPoolError("pandoc worker does not respond")
+        self._idle.put_nowait(worker)
+        for _ in range(self._size - 1):
+            self._idle.put_nowait(await self._start_worker())
+        self._healthchecks = asyncio.ensure_future(self._healthcheck())
+
+    async def _start_worker(self):
+        worker = self._worker()
+        await worker.start()
+        self._workers.add(worker)
+        return worker
+
+    async def _restart_worker(self, worker):
+        self._workers.discard(worker)
+        await worker.stop()
+        self._idle.put_nowait(await self._start_worker())
+
+    def pids(self):
+        """ the process ids of the workers """
+        return [w.pid for w in self._workers if w.pid is not None]
+
+    async def run(self, args, text):
+        """ run the pandoc call args on text using an idle worker
+
+        Raises:
+            PandocPoolError: if the call is not supported by the workers or
+                the worker crashed -- use a pandoc subprocess instead
+
+        """
+        request = pandoc_request(args)
+        worker = await self._idle.get()
+        try:
+            out = await worker.run(request, text)
+        except PandocPoolError:
+            if await worker.healthy():
+                self._idle.put_nowait(worker)
+            else:
+                asyncio.ensure_future(self._restart_worker(worker))
+            raise
+        except BaseException:
+            # e.g. cancelled mid-request, the worker's state is unknown
+            asyncio.ensure_future(self._restart_worker(worker))
+            raise
+        self._idle.put_nowait(worker)
+        return out
+
+    async def _healthcheck(self):
+        while True:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            for _ in range(self._idle.qsize()):
+                worker = self._idle.get_nowait()
+                if await worker.healthy():
+                    self._idle.put_nowait(worker)
+                else:
+                    await self._restart_worker(worker)
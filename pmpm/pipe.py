@@ -0,0 +1,172 @@
+"""
+decoding of the content piped to pmpm
+
+Two kinds of messages can be piped in, also mixed:
+
+- markdown terminated by \\0 or EOF, optionally starting with a line
+  `<!-- filepath:PATH -->`
+- frames: PIPE_MAGIC, the lengths of the filepath, the render options and the
+  markdown as unsigned 32 bit big-endian integers, then these fields, utf-8
+  encoded; the render options are a json object (may be empty), see
+  encode_frame
+
+Frames need no terminator and may contain \\0. Messages are assembled in one
+buffer, preallocated to the frame length once it is known, and decoded from
+there.
+"""
+
+
+import json
+import struct
+
+
+PIPE_MAGIC = b"PMPM\x01"
+FRAME_HEADER = struct.Struct("!III")
+FILEPATH_HEADER = b"<!-- filepath:"
+
+# initial size of the buffer
+PIPE_BUFFER_SIZE = 64 * 1024
+# frames announcing more bytes are rejected
+MAX_FRAME_SIZE = 1 << 30
+
+# render options of frames, see PipeBuffer.next_message
+FRAME_OPTIONS = {"slide-level"}
+
+
+def encode_frame(content, filepath="", options=None):
+    """ the frame to pipe content to pmpm
+
+    Args:
+        content: str: the markdown
+        filepath: the path of the markdown file, relative to home or absolute
+        options: dict of render options, "slide-level": render slides with
+            revealjs at this slide level
+
+    """
+    fields = [filepath.encode(),
+              json.dumps(options or {}).encode(),
+              content.encode()]
+    return b"".join((PIPE_MAGIC,
+                     FRAME_HEADER.pack(*(len(f) for f in fields)),
+                     *fields))
+
+
+class PipeBuffer:
+
+    def __init__(self):
+        self._buffer = bytearray(PIPE_BUFFER_SIZE)
+        # received, not yet decoded data is in _buffer[_start:_end]
+        self._start = 0
+        self._end = 0
+        # no \0 in _buffer[_start:_scanned]
+        self._scanned = 0
+
+    def feed(self, data):
+        """ append data received """
+        self._reserve(len(data))
+        self._buffer[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def next_message(self, eof=False):
+        """ decode the next complete message
+
+        Args:
+            eof: whether no more data follows, which terminates unframed
+                content
+
+        Returns:
+            message: (filepath, options, content), filepath is None if not
+                given, or None if there is no complete message
+
+        Raises:
+            ValueError: if the message cannot be decoded, it is skipped
+
+        """
+        pending = self._end - self._start
+        if not pending:
+            return None
+        if self._buffer.startswith(PIPE_MAGIC, self._start, self._end):
+            return self._next_frame(eof)
+        if pending < len(PIPE_MAGIC) and not eof and \
+                PIPE_MAGIC.startswith(self._buffer[self._start:self._end]):
+            # possibly the start of a frame
+            return None
+
+        end = self._buffer.find(b"\0", max(self._scanned, self._start),
+                                self._end)
+        if end == -1:
+            self._scanned = self._end
+            if not eof:
+                return None
+            end = self._end
+        start, self._start = self._start, min(end + 1, self._end)
+        return self._decode_unframed(start, end)
+
+    def _next_frame(self, eof):
+        header = self._start + len(PIPE_MAGIC)
+        if self._end < header + FRAME_HEADER.size:
+            if eof:
+                self._start = self._end
+                raise ValueError("incomplete frame piped in")
+            return None
+        lengths = FRAME_HEADER.unpack_from(self._buffer, header)
+        size = len(PIPE_MAGIC) + FRAME_HEADER.size + sum(lengths)
+        if size > MAX_FRAME_SIZE:
+            # cannot find the next message, drop everything
+            self._start = self._end
+            raise ValueError(f"frame of {size} bytes piped in, "
+                             f"at most {MAX_FRAME_SIZE} supported")
+        if self._end - self._start < size:
+            if eof:
+                self._start = self._end
+                raise ValueError("incomplete frame piped in")
+            # receive the rest of the frame without growing the buffer again
+            self._reserve(size - (self._end - self._start))
+            return None
+
+        pos = self._start + len(PIPE_MAGIC) + FRAME_HEADER.size
+        self._start += size
+        fields = []
+        with memoryview(self._buffer) as view:
+            for length in lengths:
+                fields.append(str(view[pos:pos + length], "utf-8"))
+                pos += length
+        filepath, options, content = fields
+        options = json.loads(options) if options else {}
+        if not isinstance(options, dict) or options.keys() - FRAME_OPTIONS:
+            raise ValueError(f"invalid render options piped in: {options}, "
+                             f"supported are {', '.join(FRAME_OPTIONS)}")
+        return filepath or None, options, content
+
+    def _decode_unframed(self, start, end):
+        filepath = None
+        if self._buffer.startswith(FILEPATH_HEADER, start, end):
+            endline = self._buffer.find(b"\n", start, end)
+            if endline == -1:
+                return None, {}, ""
+            # strip " -->"
+            filepath = start + len(FILEPATH_HEADER), endline - 4
+            start = endline + 1
+        with memoryview(self._buffer) as view:
+            if filepath is not None:
+                filepath = str(view[filepath[0]:filepath[1]], "utf-8")
+            return filepath, {}, str(view[start:end], "utf-8")
+
+    def _reserve(self, n):
+        """ make room for n more bytes """
+        pending = self._end - self._start
+        if not pending:
+            if len(self._buffer) > 16 * PIPE_BUFFER_SIZE:
+                # release the memory of a large message
+                self._buffer = bytearray(PIPE_BUFFER_SIZE)
+            self._start = self._end = self._scanned = 0
+        if self._end + n <= len(self._buffer):
+            return
+        if pending + n <= len(self._buffer):
+            self._buffer[:pending] = self._buffer[self._start:self._end]
+        else:
+            buffer = bytearray(max(2 * len(self._buffer), pending + n))
+            buffer[:pending] = self._buffer[self._start:self._end]
+            self._buffer = buffer
+        self._scanned = max(self._scanned - self._start, 0)
+        self._start, self._end = 0, pending
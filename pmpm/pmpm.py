@@ -15,48 +15,85 @@
 
 """ pmpm: pandoc markdown preview machine, a simple markdown previewer """
 
+import json
+from pathlib import Path
+import socket
 import subprocess
 
-from .utils import limport, parse_args
+from .utils import RUNTIME_DIR, limport, parse_args
 
 # import http.client lazily
 httpclient = limport('http.client')
 
 
-def run_server_in_subprocess(port, home, math):
+def run_server_in_subprocess(port, home, math, watch=()):
     """ start the websocket server in a subprocess
+
+    Args:
+        watch: paths of markdown files or directories for the server to watch
     """
     subprocess.Popen(["pmpm-websocket",
                       "--port", port,
                       "--home", home,
-                      "--math", math])
+                      "--math", math,
+                      *(arg for path in watch for arg in ("--watch", path))])
 
 
 def stop_websocket_server(port):
-    """ kills the websocket server
-
-    TODO: find a way to do this more gracefully.
+    """ terminates the websocket server, which removes its pid file
 
     Returns:
         exit_status: the exit status of the subprocess `fuser -k` system call
     """
     exit_status = subprocess.call(
-        ["fuser", "-k", f"{port}/tcp"])
+        ["fuser", "-k", "-TERM", f"{port}/tcp"])
     return exit_status
 
 
+def server_running(port):
+    """ whether the pmpm server is running on port, per its pid file
+
+    Cheaper than connecting to the server, but does not know about a server
+    about to be started by socket activation.
+    """
+    try:
+        with (RUNTIME_DIR / "websocket_port").open() as f:
+            if f.read() != str(port):
+                return False
+        with (RUNTIME_DIR / "pid").open() as f:
+            pid = int(f.read())
+        # the pid may have been reused if the server was killed
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            argv = f.read().decode(errors="replace").split("\0")
+    except (OSError, ValueError):
+        return False
+    # the pmpm-websocket script, run by its interpreter, or
+    # run_websocket_server called directly
+    return (any(Path(arg).name == "pmpm-websocket" for arg in argv[:2])
+            or any("run_websocket_server" in arg for arg in argv))
+
+
 # get status for the pmpm server
-def request_server_status(port) -> str:
+def request_server_status(port, details=False):
     """ request the pmpm server status
 
+    Args:
+        details: request the metrics of the server as well
+
     Returns:
-        status: str: the pmpm server status
+        status: str: the pmpm server status, with details a summary of the
+            metrics if the server is running
     """
     connection = httpclient.HTTPConnection("localhost",
                                            port)
     try:
         connection.connect()
         server_status = "running"
+        if details:
+            connection.request("GET", "/status")
+            response = connection.getresponse()
+            if response.status == 200:
+                server_status = format_status(json.load(response))
     except ConnectionRefusedError:
         server_status = "stopped"
     finally:
@@ -64,6 +101,74 @@ def request_server_status(port) -> str:
     return server_status
 
 
+def format_status(status):
+    """ summarize the status reported by the pmpm server
+
+    Args:
+        status: dict: the server status, see websocket.serverstatus
+
+    Returns:
+        summary: str: the summary
+    """
+    def ms(seconds):
+        return "-" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+    lines = [f"running for {status['uptime'] / 60:.0f} min, "
+             f"{status['clients']} clients, "
+             f"{len(status['sessions'])} documents"]
+    lines.append(f"{'latency':24} {'count':>7} {'mean':>8} {'p50':>8} "
+                 f"{'p90':>8} {'p99':>8} {'max':>8}")
+    for name, h in status["latency"].items():
+        lines.append(f"{name:24} {h['count']:7} {ms(h['mean']):>8} "
+                     f"{ms(h['p50']):>8} {ms(h['p90']):>8} "
+                     f"{ms(h['p99']):>8} {ms(h['max']):>8}")
+    cache = status["cache"]
+    lines.append(f"cache {cache['bytes'] / 2**20:.1f} of "
+                 f"{cache['maxbytes'] / 2**20:.0f} MB")
+    for name, c in cache["caches"].items():
+        hitrate = "-" if c["hitrate"] is None else f"{c['hitrate']:.0%}"
+        lines.append(f"  {name:22} {c['entries']:7} entries, "
+                     f"{hitrate} hits")
+    for name, n in status["counters"].items():
+        lines.append(f"{name:24} {n:7}")
+    return "\n".join(lines)
+
+
+def render_file(path):
+    """ render the markdown file path on the running pmpm server
+
+    Waits until the render is done and prints the time spent in each stage.
+
+    Returns:
+        exit_status: 0 if rendered, 1 if the render failed or was superseded
+            by newer content
+    """
+    path = Path(path).resolve()
+    request = {"filepath": str(path), "content": path.read_text()}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(RUNTIME_DIR / "socket"))
+        except (ConnectionRefusedError, FileNotFoundError):
+            print("pmpm server is not running")
+            return 1
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile() as replies:
+            for line in replies:
+                result = json.loads(line)
+                if result["status"] != "queued":
+                    break
+            else:
+                print("pmpm server closed the connection")
+                return 1
+    if result["status"] != "done":
+        print(f"{path}: {result['status']} {result.get('error', '')}")
+        return 1
+    timings = result["timings"]
+    print(f"rendered {path} in {sum(timings.values()):.3f}s ("
+          + ", ".join(f"{k} {v:.3f}s" for k, v in timings.items()) + ")")
+    return 0
+
+
 def main():
     """ The main pmpm program
 
@@ -73,15 +178,22 @@ def main():
     try:
         ARGS = parse_args()
         # first do single-shot pmpm flags:
-        if ARGS.start:
-            if request_server_status(ARGS.port) != "running":
-                run_server_in_subprocess(
-                    ARGS.port, ARGS.home, ARGS.math)
-            return 0
         if ARGS.stop:
             return stop_websocket_server(ARGS.port)
         if ARGS.status:
-            print(request_server_status(ARGS.port))
+            print(request_server_status(ARGS.port, details=True))
+            return 0
+        if ARGS.render:
+            return render_file(ARGS.render)
+        if ARGS.start or ARGS.watch:
+            if not server_running(ARGS.port) \
+                    and request_server_status(ARGS.port) != "running":
+                run_server_in_subprocess(
+                    ARGS.port, ARGS.home, ARGS.math, ARGS.watch)
+            elif ARGS.watch:
+                print("pmpm server already running, stop it first to watch "
+                      + ", ".join(ARGS.watch))
+                return 1
             return 0
 
         # only happens when no arguments are supplied,
@@ -0,0 +1,158 @@
+"""
+pre-warming the caches while idle, see pmpm-websocket --prewarm
+
+After a restart the caches are cold, and the first preview of a large file
+waits for a full render. Prewarmer renders the most recently modified
+markdown files into the caches beforehand, one file at a time and only while
+no render is in progress: a render pauses it, cancelling the file being
+pre-warmed (the blocks rendered so far stay cached), and it carries on once
+the server has been idle for IDLE_DELAY seconds. After each file it sleeps,
+so that on average it uses at most a given share of a CPU, counting the cpu
+time of long-lived children such as the pandoc workers as well.
+"""
+
+
+import asyncio
+import heapq
+import os
+from pathlib import Path
+import resource
+import time
+import traceback
+
+from .watch import MARKDOWN_SUFFIXES
+
+
+# seconds without renders before pre-warming (again)
+IDLE_DELAY = 2
+
+# stop searching directory trees after this many files
+SCAN_LIMIT = 100000
+
+
+def recent_markdown_files(paths, limit):
+    """ the limit most recently modified markdown files
+
+    Args:
+        paths: markdown files, and directory trees to search; hidden
+            directories are skipped
+
+    Returns:
+        files: list of paths, the most recently modified first
+
+    """
+    found = []
+    scanned = 0
+    for path in paths:
+        if path.is_file():
+            found.append((path.stat().st_mtime, path))
+            continue
+        for directory, dirnames, filenames in os.walk(path):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for name in filenames:
+                if Path(name).suffix in MARKDOWN_SUFFIXES:
+                    file = Path(directory) / name
+                    try:
+                        found.append((file.stat().st_mtime, file))
+                    except OSError:
+                        pass
+            scanned += len(filenames)
+            if scanned > SCAN_LIMIT:
+                break
+    return [file for _, file in heapq.nlargest(limit, set(found))]
+
+
+def proccputime(pid):
+    """ cpu time used by the running process pid, 0 if it is gone """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return 0
+    # utime and stime in clock ticks, after the command in parentheses
+    fields = stat[stat.rindex(")") + 2:].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def cputime(pids=()):
+    """ cpu time used by this process, its terminated children and the
+    running children pids, which RUSAGE_CHILDREN does not include """
+    return (sum(resource.getrusage(who).ru_utime
+                + resource.getrusage(who).ru_stime
+                for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+            + sum(proccputime(pid) for pid in pids))
+
+
+class Prewarmer:
+
+    def __init__(self, paths, limit, cpushare, warm, pids=None):
+        """
+        Args:
+            paths: markdown files and directory trees, see
+                recent_markdown_files
+            limit: maximum number of files to pre-warm
+            cpushare: share of a CPU to use on average
+            warm: coroutine function rendering a file into the caches
+            pids: function returning the pids of long-lived children that
+                warm uses, e.g. pandoc workers
+        """
+        self._paths = paths
+        self._limit = limit
+        self._cpushare = cpushare
+        self._warm = warm
+        self._pids = pids or (lambda: ())
+        self._busy = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._lastbusy = time.monotonic()
+        self._task = None
+        # whether pause cancelled the task
+        self._interrupted = False
+
+    def pause(self):
+        """ a render started, cancel pre-warming until it is idle again """
+        self._busy += 1
+        self._idle.clear()
+        if self._task is not None:
+            self._task.cancel()
+            self._interrupted = True
+
+    def resume(self):
+        """ a render finished """
+        self._busy -= 1
+        self._lastbusy = time.monotonic()
+        if not self._busy:
+            self._idle.set()
+
+    async def _waitidle(self):
+        while True:
+            await self._idle.wait()
+            wait = self._lastbusy + IDLE_DELAY - time.monotonic()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        files = await loop.run_in_executor(
+            None, recent_markdown_files, self._paths, self._limit)
+        while files:
+            await self._waitidle()
+            start, startcpu = time.monotonic(), cputime(self._pids())
+            self._task = loop.create_task(self._warm(files[0]))
+            self._interrupted = False
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                if not self._interrupted:
+                    raise
+                # paused, try again once idle
+                continue
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._task = None
+            files.pop(0)
+            elapsed = time.monotonic() - start
+            used = max(cputime(self._pids()) - startcpu, elapsed)
+            await asyncio.sleep(max(used / self._cpushare - elapsed, 0))
@@ -0,0 +1,158 @@
+"""
+opt-in profiling of renders, see pmpm-websocket --profile
+
+Each render gets a RenderTrace, a timeline of its stages: the wait in the
+queue, md2json, the title block, each block (cache hits as instants, rendered
+blocks as the spans of their pandoc calls), citeproc and sending to the
+clients. Profiler writes the timelines to a directory in the Chrome trace
+event format, which chrome://tracing, Perfetto and speedscope load, and
+profiles every few renders with cProfile as well (pstats files, e.g. for
+snakeviz). Only the files of the last renders are kept.
+"""
+
+
+import asyncio
+from contextlib import contextmanager
+import contextvars
+from itertools import count
+import json
+import os
+import time
+
+from .utils import limport
+
+# import cProfile lazily, it is only needed with --profile
+cProfile = limport('cProfile')
+
+
+# the trace of the render in progress, None if not profiling
+RENDER_TRACE = contextvars.ContextVar("render_trace", default=None)
+
+
+class RenderTrace:
+
+    def __init__(self, traceid, fpath):
+        self.id = traceid
+        self.fpath = fpath
+        self.events = []
+        self.profile = None
+        # asyncio tasks -> trace thread ids, so that concurrent spans are
+        # shown side by side
+        self._tids = {}
+
+    def _tid(self):
+        task = asyncio.current_task()
+        return self._tids.setdefault(id(task), len(self._tids))
+
+    def span(self, name, start, end=None, **args):
+        """ add the span from start to end (time.perf_counter()) """
+        if end is None:
+            end = time.perf_counter()
+        self.events.append({"name": name, "ph": "X", "pid": os.getpid(),
+                            "tid": self._tid(),
+                            "ts": start * 1e6, "dur": (end - start) * 1e6,
+                            "args": args})
+
+    def instant(self, name, **args):
+        self.events.append({"name": name, "ph": "i", "s": "t",
+                            "pid": os.getpid(), "tid": self._tid(),
+                            "ts": time.perf_counter() * 1e6, "args": args})
+
+    @contextmanager
+    def record(self, name, **args):
+        """ add the time spent in the block as a span """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            args["error"] = type(e).__name__
+            raise
+        finally:
+            self.span(name, start, **args)
+
+    def chrome(self):
+        """ the trace in the Chrome trace event format """
+        return {"traceEvents": self.events,
+                "displayTimeUnit": "ms",
+                "otherData": {"render": self.id, "filepath": str(self.fpath)}}
+
+
+@contextmanager
+def traced(name, **args):
+    """ record the block in the trace of the render in progress, if any """
+    trace = RENDER_TRACE.get()
+    if trace is None:
+        yield
+    else:
+        with trace.record(name, **args):
+            yield
+
+
+class Profiler:
+
+    def __init__(self, directory, keep, cprofile_every):
+        """
+        Args:
+            directory: where to write the traces
+            keep: number of renders whose files are kept
+            cprofile_every: profile every this many renders with cProfile,
+                0 never
+        """
+        self.directory = directory
+        self.keep = max(keep, 1)
+        self.cprofile_every = cprofile_every
+        self._started = count()
+        self._written = []
+        # only one cProfile profiler can be active at a time
+        self._cprofiling = False
+
+    def start(self, renderid, fpath):
+        """ a new trace of the render renderid, with cProfile running if
+        due """
+        trace = RenderTrace(renderid, fpath)
+        if (self.cprofile_every and not self._cprofiling
+                and next(self._started) % self.cprofile_every == 0):
+            trace.profile = cProfile.Profile()
+            trace.profile.enable()
+            self._cprofiling = True
+        return trace
+
+    def finish(self, trace):
+        """ stop cProfile and write the trace, again if called again """
+        profile, trace.profile = trace.profile, None
+        if profile is not None:
+            profile.disable()
+            self._cprofiling = False
+        self._save(trace, profile)
+
+    def update(self, trace):
+        """ write the trace again, without stopping cProfile: the render may
+        still be running """
+        self._save(trace, None)
+
+    def _save(self, trace, profile):
+        if trace.id not in self._written:
+            if self._written and trace.id < self._written[0]:
+                # its files were removed already
+                return
+            self._written.append(trace.id)
+        expired = self._written[:-self.keep]
+        del self._written[:-self.keep]
+        asyncio.get_event_loop().run_in_executor(
+            None, self._write, trace.id, json.dumps(trace.chrome()), profile,
+            expired)
+
+    def _write(self, traceid, chrome, profile, expired):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"render-{traceid}.trace.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(chrome)
+        tmp.replace(path)
+        if profile is not None:
+            profile.dump_stats(self.directory / f"render-{traceid}.prof")
+        for old in expired:
+            for suffix in ("trace.json", "prof"):
+                try:
+                    (self.directory / f"render-{old}.{suffix}").unlink()
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,93 @@
+"""
+bounded, prioritized scheduling of pandoc processes
+
+RenderScheduler limits how many pandoc processes run at once. When the limit
+is reached, waiting calls are started by priority, then first come first
+served. The priority of a call is taken from the context, so that it need not
+be passed through the cached functions:
+
+    with priority(PRIORITY_TITLE):
+        titleblock = await json2titleblock(...)
+
+Within background(), all calls have PRIORITY_BACKGROUND, whatever priority
+the code they run in asks for.
+"""
+
+
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+import contextvars
+import heapq
+from itertools import count
+
+
+PRIORITY_TITLE = 0
+PRIORITY_EDITING = 1
+PRIORITY_DEFAULT = 2
+PRIORITY_CITEPROC = 3
+PRIORITY_BACKGROUND = 4
+
+PRIORITY = contextvars.ContextVar("priority", default=PRIORITY_DEFAULT)
+BACKGROUND = contextvars.ContextVar("background", default=False)
+
+
+@contextmanager
+def priority(prio):
+    """ run pandoc calls within this context with priority prio """
+    token = PRIORITY.set(prio)
+    try:
+        yield
+    finally:
+        PRIORITY.reset(token)
+
+
+@contextmanager
+def background():
+    """ run pandoc calls within this context with PRIORITY_BACKGROUND """
+    token = BACKGROUND.set(True)
+    try:
+        yield
+    finally:
+        BACKGROUND.reset(token)
+
+
+class RenderScheduler:
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.running = 0
+        # heap of (priority, sequence number, future)
+        self._waiting = []
+        self._count = count()
+
+    async def acquire(self, prio):
+        if self.running < self.limit and not self._waiting:
+            self.running += 1
+            return
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._waiting, (prio, next(self._count), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # got a slot but was cancelled before using it
+                self.release()
+            raise
+
+    def release(self):
+        self.running -= 1
+        while self._waiting and self.running < self.limit:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                self.running += 1
+                future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self):
+        """ wait for a slot to run pandoc with the priority of the context """
+        await self.acquire(PRIORITY_BACKGROUND if BACKGROUND.get()
+                           else PRIORITY.get())
+        try:
+            yield
+        finally:
+            self.release()
@@ -5,6 +5,7 @@ from pathlib import Path
 
 
 BASE_DIR = Path(__file__).parent
+RUNTIME_DIR = Path(os.environ.get("XDG_RUNTIME_DIR", "/tmp")) / "pmpm"
 
 
 class limport:
@@ -18,6 +19,11 @@ class limport:
         return getattr(self._package, get)
 
 
+def envpaths(name):
+    """ the paths in the environment variable name, separated by os.pathsep """
+    return [p for p in os.environ.get(name, "").split(os.pathsep) if p]
+
+
 def parse_args(args=None, websocket=False) -> argparse.Namespace:
     """ populate the pmpm command line arguments
 
@@ -50,7 +56,181 @@ def parse_args(args=None, websocket=False) -> argparse.Namespace:
         choices=["mathml", "katex"],
         help="whether to use pandoc's mathml or katex math mode",
     )
-    if not websocket:
+    parser.add_argument(
+        "--watch",
+        action="append",
+        # PMPM_DEFAULT_WATCH, unless given on the command line, see below
+        default=None,
+        metavar="PATH",
+        help=("render the markdown file PATH whenever it changes, or any "
+              "markdown file in the directory tree PATH (relative to home, "
+              "can be given several times), instead of piping content in"),
+    )
+    if websocket:
+        parser.add_argument(
+            "--pandoc-backend",
+            default=os.environ.get("PMPM_DEFAULT_PANDOC_BACKEND",
+                                   "subprocess"),
+            choices=["subprocess", "lua", "server"],
+            help=("how to run pandoc: a new subprocess per conversion, or a "
+                  "pool of warm `pandoc lua` or `pandoc-server` workers "
+                  "(pandoc >= 3.0; pandoc-server listens on a local port); "
+                  "conversions the workers cannot handle, e.g. citeproc, "
+                  "always use a subprocess"),
+        )
+        parser.add_argument(
+            "--pandoc-workers",
+            type=int,
+            default=os.environ.get("PMPM_DEFAULT_PANDOC_WORKERS",
+                                   os.cpu_count() or 1),
+            help="number of warm pandoc workers",
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=os.environ.get("PMPM_DEFAULT_JOBS", os.cpu_count() or 1),
+            help="maximum number of pandoc conversions running at once",
+        )
+        parser.add_argument(
+            "--min-delay",
+            type=float,
+            default=os.environ.get("PMPM_DEFAULT_MIN_DELAY", 0),
+            help="minimum delay in seconds after a render before rendering "
+                 "new content",
+        )
+        parser.add_argument(
+            "--max-delay",
+            type=float,
+            default=os.environ.get("PMPM_DEFAULT_MAX_DELAY", 1),
+            help="maximum delay in seconds after a render before rendering "
+                 "new content; within the bounds, the delay adapts to the "
+                 "render durations and the rate of new content",
+        )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            default=os.environ.get("PMPM_DEFAULT_STREAM", False),
+            help="send the block order before the blocks are rendered, then "
+                 "the blocks as they are rendered",
+        )
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            default=os.environ.get("PMPM_DEFAULT_PROFILE", False),
+            help=("write a timeline of each render to "
+                  "$XDG_RUNTIME_DIR/pmpm/profile in the Chrome trace event "
+                  "format, and profile some renders with cProfile"),
+        )
+        parser.add_argument(
+            "--profile-keep",
+            type=int,
+            default=os.environ.get("PMPM_DEFAULT_PROFILE_KEEP", 50),
+            help="number of renders whose profiles are kept",
+        )
+        parser.add_argument(
+            "--profile-cprofile-every",
+            type=int,
+            default=os.environ.get("PMPM_DEFAULT_PROFILE_CPROFILE_EVERY", 10),
+            help=("profile every this many renders with cProfile, "
+                  "0 disables cProfile"),
+        )
+        parser.add_argument(
+            "--prewarm",
+            type=int,
+            default=os.environ.get("PMPM_DEFAULT_PREWARM", 0),
+            metavar="N",
+            help=("while idle, render the N most recently modified markdown "
+                  "files under home (or --prewarm-path) into the caches, "
+                  "so that opening them after a restart is fast; "
+                  "0 disables pre-warming"),
+        )
+        parser.add_argument(
+            "--prewarm-path",
+            action="append",
+            # PMPM_DEFAULT_PREWARM_PATH, unless given on the command line,
+            # see below
+            default=None,
+            metavar="PATH",
+            help=("markdown file or directory tree to pre-warm, relative to "
+                  "home, can be given several times"),
+        )
+        parser.add_argument(
+            "--prewarm-cpu",
+            type=float,
+            default=os.environ.get("PMPM_DEFAULT_PREWARM_CPU", .5),
+            help="share of a CPU pre-warming uses at most on average",
+        )
+        parser.add_argument(
+            "--incremental-parse",
+            action="store_true",
+            default=os.environ.get("PMPM_DEFAULT_INCREMENTAL_PARSE", False),
+            help=("only re-parse the changed parts of the markdown, if the "
+                  "document can be split into independent top-level chunks"),
+        )
+        parser.add_argument(
+            "--fast-writer",
+            action="store_true",
+            default=os.environ.get("PMPM_DEFAULT_FAST_WRITER", False),
+            help=("render simple blocks (paragraphs, headers, bullet lists, "
+                  "code blocks without language) in python instead of "
+                  "pandoc, if the output of both agrees on a set of samples "
+                  "at startup; blocks are then rendered without line "
+                  "wrapping"),
+        )
+        parser.add_argument(
+            "--compression-level",
+            type=int,
+            default=os.environ.get("PMPM_DEFAULT_COMPRESSION_LEVEL", 6),
+            choices=range(10),
+            help=("zlib compression level for websocket messages, "
+                  "0 disables compression"),
+        )
+        parser.add_argument(
+            "--compression-window-bits",
+            type=int,
+            default=os.environ.get("PMPM_DEFAULT_COMPRESSION_WINDOW_BITS",
+                                   12),
+            choices=range(9, 16),
+            help="zlib window size for websocket per-message deflate",
+        )
+        parser.add_argument(
+            "--compression-mem-level",
+            type=int,
+            default=os.environ.get("PMPM_DEFAULT_COMPRESSION_MEM_LEVEL", 5),
+            choices=range(1, 10),
+            help="zlib memory level for websocket per-message deflate",
+        )
+        parser.add_argument(
+            "--compression-threshold",
+            type=int,
+            default=os.environ.get("PMPM_DEFAULT_COMPRESSION_THRESHOLD",
+                                   16384),
+            help=("messages of at least this many bytes are deflated once "
+                  "and sent as binary frames to clients supporting it"),
+        )
+        parser.add_argument(
+            "--cache-memory",
+            type=int,
+            default=os.environ.get("PMPM_DEFAULT_CACHE_MEMORY", 512),
+            help="approximate memory in MB for caching pandoc results",
+        )
+        parser.add_argument(
+            "--disk-cache-size",
+            type=int,
+            default=os.environ.get("PMPM_DEFAULT_DISK_CACHE_SIZE", 0),
+            help=("maximum size in MB of the persistent cache of pandoc "
+                  "results, 0 disables the persistent cache"),
+        )
+        parser.add_argument(
+            "--disk-cache-dir",
+            default=os.environ.get(
+                "PMPM_DEFAULT_DISK_CACHE_DIR",
+                Path(os.environ.get("XDG_CACHE_HOME", "~/.cache")
+                     ).expanduser() / "pmpm"),
+            help="directory of the persistent cache of pandoc results",
+        )
+    else:
         single_shot_arguments = parser.add_mutually_exclusive_group()
         single_shot_arguments.add_argument(
             "--status",
@@ -64,6 +244,12 @@ def parse_args(args=None, websocket=False) -> argparse.Namespace:
             default=os.environ.get("PMPM_DEFAULT_START_SERVER", False),
             help="start the pmpm server (without doing anything else)",
         )
+        single_shot_arguments.add_argument(
+            "--render",
+            metavar="FILE",
+            help=("render the markdown file FILE, wait until the render is "
+                  "done and print its timings"),
+        )
         single_shot_arguments.add_argument(
             "--stop",
             action="store_true",
@@ -71,6 +257,11 @@ def parse_args(args=None, websocket=False) -> argparse.Namespace:
             help="stop the pmpm server (without doing anything else)",
         )
     parsed_args = parser.parse_args(args=args)
+    # argparse would append to a list default instead of replacing it
+    if parsed_args.watch is None:
+        parsed_args.watch = envpaths("PMPM_DEFAULT_WATCH")
+    if websocket and parsed_args.prewarm_path is None:
+        parsed_args.prewarm_path = envpaths("PMPM_DEFAULT_PREWARM_PATH")
     parsed_args.home = Path(parsed_args.home).expanduser().resolve()
     if not parsed_args.home.is_dir():
         raise ValueError(
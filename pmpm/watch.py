@@ -0,0 +1,121 @@
+"""
+watch markdown files and directory trees for changes
+
+Watcher reports the content of watched markdown files whenever they change,
+as an alternative to piping the files to pmpm. Events arriving in quick
+succession, e.g. an editor writing a file in several steps, are coalesced.
+
+Changed files are read as a whole: producing the new content as str copies
+the whole file anyway, and reading and decoding it is faster than finding
+and decoding only the changed byte range.
+"""
+
+
+import asyncio
+import os
+from pathlib import Path
+
+from .inotify import (IN_CLOSE_WRITE, IN_CREATE, IN_MOVED_TO, IN_ONLYDIR,
+                      Inotify)
+
+
+IN_MODIFY = 0x00000002
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+
+MARKDOWN_SUFFIXES = {".md", ".markdown", ".mdown", ".mkd"}
+
+# changes within this many seconds are reported once
+COALESCE_DELAY = .1
+
+
+class Watcher:
+
+    def __init__(self, paths, onchange):
+        """
+        Args:
+            paths: markdown files, and directories whose markdown files to
+                watch, recursively
+            onchange: function called with the path and the content (str) of
+                a changed file
+        """
+        self._paths = [Path(p).resolve() for p in paths]
+        self._onchange = onchange
+        self._inotify = None
+        # watch descriptor -> (directory, whether all of its markdown files
+        # are watched)
+        self._dirs = {}
+        self._files = set()
+        self._pending = set()
+        self._scheduled = False
+
+    def start(self):
+        """ start watching, report the content of watched files right away
+
+        Paths that cannot be watched, e.g. missing ones, are reported and
+        skipped.
+
+        Raises:
+            OSError: if inotify is not available
+
+        """
+        self._inotify = Inotify()
+        for path in self._paths:
+            if path.is_dir():
+                self._watchtree(path)
+                continue
+            try:
+                wd = self._inotify.add_watch(path.parent, WATCH_MASK)
+            except OSError as e:
+                print(f"pmpm: cannot watch {path}: {e}")
+                continue
+            self._files.add(path)
+            # the directory may be watched as part of a tree already
+            tree = self._dirs.get(wd, (None, False))[1]
+            self._dirs[wd] = (path.parent, tree)
+            self._pending.add(path)
+        asyncio.get_event_loop().add_reader(self._inotify.fd,
+                                            self._readevents)
+        self._schedule()
+
+    def _watchtree(self, directory):
+        for subdir, dirnames, _ in os.walk(directory):
+            # skip hidden directories such as .git
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            try:
+                wd = self._inotify.add_watch(subdir, WATCH_MASK)
+            except OSError:
+                continue
+            self._dirs[wd] = (Path(subdir), True)
+
+    def _readevents(self):
+        for wd, mask, name in self._inotify.read_events():
+            if wd not in self._dirs or not name:
+                continue
+            directory, tree = self._dirs[wd]
+            path = directory / name
+            if mask & IN_ISDIR:
+                if tree and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watchtree(path)
+            elif path in self._files or (
+                    tree and path.suffix.lower() in MARKDOWN_SUFFIXES):
+                self._pending.add(path)
+                self._schedule()
+
+    def _schedule(self):
+        if self._pending and not self._scheduled:
+            self._scheduled = True
+            asyncio.get_event_loop().call_later(COALESCE_DELAY, self._report)
+
+    def _report(self):
+        self._scheduled = False
+        pending, self._pending = self._pending, set()
+        for path in pending:
+            try:
+                text = path.read_bytes().decode()
+            except (OSError, ValueError) as e:
+                # deleted meanwhile, or not utf-8 (yet)
+                print(f"pmpm: cannot read {path}: {e}")
+                continue
+            self._onchange(path, text)
@@ -1,96 +1,278 @@
 """
 run_websocket_server():
-    entry point, mkfifo, start websocket server and monitorpipe
+    entry point, mkfifo, start websocket server and monitorpipe, write the
+    pid file, then --> deferred_startup
+deferred_startup:
+    probes pandoc (see pandoc_capabilities, persisted until pandoc changes),
+    starts PANDOC_POOL, WATCHER and PREWARMER; renders wait for it
 monitorpipe():
     connects read NAMED_PIPE, reconnects upon PIPE_LOST event
 ReadPipeProtocol:
     buffers piped in content,
-    queues and triggers processqueue when EOF or \0 received,
+    assembles piped in content in a PipeBuffer, \0 or EOF terminated or
+    framed, decode_pipe_content --> newcontent,
     PIPE_LOST event on connection_lost
+WATCHER:
+    with --watch, reads markdown files and directory trees under --home on
+    change, coalescing events --> newcontent
+serve_render_requests:
+    json requests on the unix socket RUNTIME_DIR/socket, answered with a
+    render id, and once rendered with the per stage timings; a stale socket
+    is replaced, one served by another pmpm-websocket is left alone
+    --> newcontent
+newcontent:
+    switches FOLLOWERS to the session of the document, queues and triggers
+    processqueue
+Session:
+    queue, render and citeproc state of one document and its subscribers,
+    see getsession, subscribe, unsubscribe, dropsession
 progressbar
+queuecontent:
+    queues new content of a session, cancelling the render of older content
+    of the session unless its pacer lets the render finish
 processqueue:
-    processes queue when triggered and not yet PROCESSING
-    --> new_pipe_content or new_filepath_request
-new_pipe_content:
-    decodes input, resolves filepath if given
-    --> process_new_content
+    processes the queue of a session when triggered and not yet processing,
+    waits the delay chosen by the session's pacer after each render
+    --> process_new_content or new_filepath_request
+PREWARMER:
+    with --prewarm, renders recently modified markdown files into the caches
+    while no render is in progress, see prewarm
+decode_pipe_content:
+    resolves filepath if given, and the slide level of framed content
 new_filepath_request:
     retrieves file
     --> process_new_content
 process_new_content:
-    compiles message to distribute to JSCLIENTS;
+    compiles message to distribute to the subscribers, first a partial
+    message if the blocks in the viewport of the client could be rendered
+    first, with --stream partial messages as blocks are rendered;
+    the sends are not awaited, a slow client does not hold up the queue
+    --> send_htmlblocks_to_js_clients
 serve_client / register_client / unregister_client:
-    handles JSCLIENTS
+    handles JSCLIENTS, which follow the pipe by default
     --> handle_message
 readfile
 handle_message:
     JSCLIENTS send either
-        filepath request: queue and trigger processqueue
+        filepath request: switch to the session of the file, queue and
+        trigger processqueue
+    or
+        subscribe / unsubscribe: receive the messages of another session too,
+        or not anymore
+    or
+        follow / unfollow: switch to documents piped in, or not
+    or
+        protocol version: the client understands delta updates
+    or
+        resync request: resend the full htmlblocks
+    or
+        viewport: the first and last htmlblock visible in the client
+    or
+        stats request: send the serverstatus
     or
         citeproc: trigger citeproc
-send_message_to_all_js_clients
+send_message_to_js_clients
+send_htmlblocks_to_js_clients:
+    JSCLIENTS that announced the delta protocol get the block order and only
+    the html of blocks they do not hold yet, all other JSCLIENTS get all
+    htmlblocks
+ServerProtocol.process_request:
+    answers http requests for /status with the serverstatus: the sessions,
+    cache occupancy and hit rates, and METRICS
+encodemessage:
+    large messages are deflated once per broadcast and sent as binary frames
+    to JSCLIENTS that connected with ?encoding=deflate
 citeproc:
     `--filter pandoc-citeproc` is sloow,
     thus JSCLIENTS request bibliographic information only when needed,
     which is responded to by citeproc,
     or citeproc is triggered upon changed bibinfo to distribute
-    new bibdetails to all clients
+    new bibdetails to all subscribers
+dependencies_changed:
+    FILES reports changed bibliography, csl and asset files via inotify,
+    sessions depending on them run citeproc again (citeproc_changed) or are
+    told to reload assets; files no session depends on are untracked again
 citeproc_sub:
-    cached subprocess pandoc call
+    cached subprocess pandoc call, with only the cited entries of the
+    bibliography taken from BIBINDEX (pandoc >= 2.11)
+run_pandoc:
+    waits for a SCHEDULER slot by priority of the context, then runs a pandoc
+    call on PANDOC_POOL if available, else in a subprocess; with check=True,
+    raises PandocError if pandoc fails
+PROFILER:
+    with --profile, writes a trace of each render, recorded via stage and
+    traced, to RUNTIME_DIR/profile, and samples renders with cProfile
+run_pandoc_diskcached:
+    looks up the result of a pandoc call in DISKCACHE first, stores it only if
+    pandoc succeeded
 uniqueciteprocdict
 md2json
+md2json_incremental:
+    splits markdown into chunks, CHUNKCACHE'd chunk-wise conversion,
+    parses all changed chunks in one pandoc call, else falls back to md2json
 json2htmlblock:
-    alru_cached block-wise conversion,
+    block-wise conversion, stored in BLOCKCACHE,
     relative links are rewritten as file:// links,
     onclick event allows pmpm.js to load .md links in pmpm
+json2htmlblocks:
+    looks up all blocks in BLOCKCACHE, with --fast-writer renders simple
+    blocks in python (see check_fast_writer), looks up the others in
+    DISKCACHE, renders the misses in a few batched pandoc calls
+    --> json2htmlblocks_batch (asynchronously, one per core)
+    --> json2htmlblock (asynchronously, blocks that cannot be batched)
 md2htmlblocks:
     --> md2json
-    BIBQUEUE = (uniqueciteprocdict, hash, cwd) for citeproc
-    --> json2htmlblock (asynchronously)
+    session.bibqueue = (uniqueciteprocdict, hash, cwd) for citeproc
+    --> json2htmlblocks
 """
 
 
 import asyncio
-from async_lru import alru_cache
-import concurrent.futures
+from collections import Counter
+from contextlib import contextmanager
+import contextvars
+from http import HTTPStatus
 from itertools import count
 import json
 import os
 from pathlib import Path
 import re
+import shutil
+import signal
 import subprocess
+import time
 import traceback
+from urllib.parse import parse_qs, unquote, urlsplit
 import uvloop
-from socket import socket
+from socket import AF_UNIX, socket
 import websockets
-from .utils import BASE_DIR, citeblock_generator, parse_args
+from websockets.extensions.permessage_deflate import (
+    ServerPerMessageDeflateFactory)
+import zlib
+from .bibliography import BibliographyIndex, bibliography_files
+from .cache import CacheBudget, LRUCache, cached, digest
+from .diskcache import DiskCache, cachekey
+from .metrics import Metrics
+from .pacer import Pacer
+from .pipe import PipeBuffer
+from .profiling import RENDER_TRACE, Profiler, traced
+from .scheduler import (PRIORITY_CITEPROC, PRIORITY_DEFAULT, PRIORITY_EDITING,
+                        PRIORITY_TITLE, RenderScheduler, background,
+                        priority)
+from .utils import (BASE_DIR, RUNTIME_DIR, citeblock_generator, limport,
+                    parse_args)
+
+# import the modules of optional features lazily, for a fast startup
+htmlwriter = limport('pmpm.htmlwriter')
+incremental = limport('pmpm.incremental')
+inotify = limport('pmpm.inotify')
+pandocpool = limport('pmpm.pandocpool')
+prewarming = limport('pmpm.prewarm')
+watch = limport('pmpm.watch')
+
+
+# All caches share one memory budget (--cache-memory). Results of md2json and
+# citeproc_sub can be quite large -- easily 100kB or so -- while blocks are
+# small; the size-weighted LRU eviction thus evicts a few large full file
+# results rather than many blocks.
+CACHE_BUDGET = CacheBudget(512 * 1024 * 1024)
+
+# latency histograms and counters, served at /status along with the cache
+# statistics
+METRICS = Metrics()
+
+BLOCKCACHE = LRUCache("json2htmlblock", CACHE_BUDGET)
+# Raw html block put between blocks when rendering several blocks in one
+# pandoc call; pandoc passes it through verbatim, so the output can be split
+# at it again. The random part avoids clashes with the user's raw html.
+BLOCK_SENTINEL = f"<!-- pmpm-block-{os.urandom(8).hex()} -->"
+
+# markdown chunk -> pandoc json blocks, for md2json_incremental
+CHUNKCACHE = LRUCache("md2json_incremental", CACHE_BUDGET)
+# the pandoc-api-version of the blocks in CHUNKCACHE
+CHUNK_API_VERSION = None
 
+JSCLIENTS = set()
 
-LRU_CACHE_SIZE_BLOCK = 8192
-# Use smaller cache size for md2json and citeproc_sub. These change very often
-# , i.e. they do not only cache one block or similar, and their results can be
-# quite large -- easily 100kB or so. Having 1000s of cached entries then would
-# be GBs of memory. Thus, only cache a few items. Then, e.g. going back a few
-# times after a typo or so still hits the cache, but we don't spend a lot of
-# memory even for larger .md files.
-LRU_CACHE_SIZE_FULL_FILE = 10
+# absolute filepath -> Session
+SESSIONS = {}
+# JSCLIENTS that switch to whichever document is piped in
+FOLLOWERS = set()
+# the session of the document piped in last
+PIPESESSION = None
 
-JSCLIENTS = set()
+DELTA_PROTOCOL_VERSION = 1
+# JSCLIENTS using the delta protocol -> (version, Counter of block hashes) of
+# the htmlblocks they hold
+DELTACLIENTS = {}
+# versions of the htmlblocks sent, unique across sessions
+HTMLBLOCKS_VERSIONS = count()
 
-asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
-EVENT_LOOP = asyncio.get_event_loop()
+# blocks around the viewport to render first as well
+VIEWPORT_MARGIN = 10
 
-QUEUE = None
-PROCESSING = False
+# with --stream, at most this many blocks per pandoc call, and at most one
+# partial message per STREAM_INTERVAL seconds
+STREAM_BATCH_SIZE = 20
+STREAM_INTERVAL = .1
 
-BIBQUEUE = None
-BIBPROCESSING = False
-LASTBIB = None
+# First byte of binary frames: the rest is the zlib-deflated json message
+BINARY_FRAME_DEFLATE = b"\x01"
+
+asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+EVENT_LOOP = asyncio.get_event_loop()
 
-RUNTIME_DIR = Path(os.environ.get("XDG_RUNTIME_DIR", "/tmp")) / "pmpm"
 PIPE_LOST = asyncio.Event()
+# set once the startup work deferred until the sockets are bound is done,
+# see deferred_startup
+STARTED = asyncio.Event()
 
 PANDOC_CALLS = {}
+PANDOC_POOL = None
+PANDOC_VERSION = None
+SCHEDULER = RenderScheduler(os.cpu_count() or 1)
+
+DISKCACHE = None
+BIBINDEX = None
+# bibliographies, csl styles and images the documents depend on
+FILES = None
+# markdown files watched with --watch
+WATCHER = None
+# the server of render requests on RUNTIME_DIR/socket, referenced so that it
+# is not garbage collected and closed
+RENDER_SERVER = None
+# render traces with --profile
+PROFILER = None
+# renders recently modified files into the caches while idle, with --prewarm
+PREWARMER = None
+# with --fast-writer, whether blocks2html renders simple blocks with these
+# options, see check_fast_writer
+FAST_WRITER = False
+FAST_WRITER_OPTIONS = ("--to", "html5")
+
+# ids of the renders, those of render requests received on RUNTIME_DIR/socket
+# are answered with theirs and name the traces with --profile
+RENDER_IDS = count(1)
+# stage -> seconds spent in it by the render in progress, see stage
+RENDER_TIMINGS = contextvars.ContextVar("render_timings", default=None)
+# maximum length of a render request line
+RENDER_REQUEST_LIMIT = 1 << 30
+
+
+@contextmanager
+def stage(name):
+    """ add the time spent in the block to the timings of the render, and
+    to its trace with --profile """
+    timings = RENDER_TIMINGS.get()
+    if timings is None:
+        yield
+        return
+    start = EVENT_LOOP.time()
+    try:
+        with traced(name):
+            yield
+    finally:
+        timings[name] = timings.get(name, 0) + EVENT_LOOP.time() - start
 
 
 def read_socket_activation_fds():
@@ -121,7 +303,63 @@ def read_socket_activation_fds():
     return (fd_pipe, fd_websocket)
 
 
-def init_pandoc_calls():
+def pandoc_capabilities():
+    """ the version of pandoc and whether it has --citeproc
+
+    Probing runs pandoc twice, which is slow compared to the rest of the
+    startup. The result is thus kept in --disk-cache-dir, along with the
+    path, mtime and size of the pandoc binary, and pandoc is only probed
+    again once it changed.
+
+    Returns:
+        capabilities: dict with keys version and citeproc
+
+    """
+    path = shutil.which("pandoc")
+    record = Path(ARGS.disk_cache_dir) / "pandoc.json"
+    key = None
+    if path is not None:
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        key = [path, stat.st_mtime_ns, stat.st_size]
+        try:
+            with record.open() as f:
+                capabilities = json.load(f)
+            if capabilities["key"] == key:
+                return capabilities
+        except (OSError, ValueError, KeyError):
+            pass
+
+    proc = subprocess.run(("pandoc", "--version"),
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL)
+    version = proc.stdout.decode().partition("\n")[0]
+    # Since pandoc 2.11 "--filter pandoc-citeproc" should be replaced by
+    # "--citeproc". Check if we can use --citeproc.
+    proc = subprocess.Popen(
+        ("pandoc", "--citeproc"),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    proc.communicate("")
+    capabilities = {"key": key,
+                    "version": version,
+                    "citeproc": proc.returncode == 0}
+    if key is not None:
+        try:
+            record.parent.mkdir(parents=True, exist_ok=True)
+            tmp = record.with_suffix(".tmp")
+            with tmp.open('w') as f:
+                json.dump(capabilities, f)
+            tmp.replace(record)
+        except OSError:
+            pass
+    return capabilities
+
+
+def init_pandoc_calls(capabilities):
+    global PANDOC_VERSION
+    PANDOC_VERSION = capabilities["version"]
 
     # For md2json
     PANDOC_CALLS["md2json"] = ("pandoc",
@@ -140,32 +378,44 @@ def init_pandoc_calls():
                                        "--"+ARGS.math)
 
     # For citeproc
-    # Since pandoc 2.11 "--filter pandoc-citeproc" should be replaced by
-    # "--citeproc". Check if we can use --citeproc.
-    proc = subprocess.Popen(
-        ("pandoc", "--citeproc"),
-        stdin=subprocess.PIPE,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL)
-    proc.communicate("")
-    has_internal_citeproc = proc.returncode == 0
-
     PANDOC_CALLS["citeproc"] = ("pandoc",
                                 "--from", "json", "--to", "html5",
                                 "--"+ARGS.math)
-    if has_internal_citeproc:
+    if capabilities["citeproc"]:
         PANDOC_CALLS["citeproc"] += ("--citeproc",)
+        # pandoc >= 2.11 also converts bibliographies to CSL JSON
+        global BIBINDEX
+        BIBINDEX = BibliographyIndex(RUNTIME_DIR / "bibliography",
+                                     run_pandoc_diskcached)
     else:
         PANDOC_CALLS["citeproc"] += ("--filter", "pandoc-citeproc",)
 
 
+def render_socket_in_use(path):
+    """ whether a server accepts connections on the unix socket path
+
+    A stale socket left behind by a server that exited refuses connections.
+    """
+    if not path.is_socket():
+        return False
+    with socket(AF_UNIX) as sock:
+        try:
+            sock.connect(str(path))
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+    return True
+
+
 def run_websocket_server():
-    """ start and run the websocket server """
+    """ start and run the websocket server
+
+    The sockets are bound first, so that clients can connect right away;
+    all other startup work is deferred, see deferred_startup.
+    """
     global ARGS
     ARGS = parse_args(websocket=True)
-
-    # Init pandoc command to be called later
-    init_pandoc_calls()
+    CACHE_BUDGET.maxbytes = ARGS.cache_memory * 1024 * 1024
+    SCHEDULER.limit = ARGS.jobs
 
     if not RUNTIME_DIR.is_dir():
         os.mkdir(RUNTIME_DIR)
@@ -186,20 +436,57 @@ def run_websocket_server():
     (fd_pipe, fd_websocket) = read_socket_activation_fds()
 
     # Start websocket server
-    EVENT_LOOP.set_default_executor(
-        concurrent.futures.ProcessPoolExecutor(max_workers=None))
+    if ARGS.compression_level:
+        extensions = [ServerPerMessageDeflateFactory(
+            server_max_window_bits=ARGS.compression_window_bits,
+            client_max_window_bits=ARGS.compression_window_bits,
+            compress_settings={"level": ARGS.compression_level,
+                               "memLevel": ARGS.compression_mem_level})]
+    else:
+        extensions = []
+    serve_kwargs = {"create_protocol": ServerProtocol,
+                    "compression": None,
+                    "extensions": extensions}
     if fd_websocket is not None:
         WEBSOCKETS_SERVER = websockets.serve(serve_client,
-                                             sock=socket(fileno=fd_websocket))
+                                             sock=socket(fileno=fd_websocket),
+                                             **serve_kwargs)
     else:
         WEBSOCKETS_SERVER = websockets.serve(serve_client,
                                              "127.0.0.1",
-                                             ARGS.port)
+                                             ARGS.port,
+                                             **serve_kwargs)
     EVENT_LOOP.run_until_complete(WEBSOCKETS_SERVER)
 
     # Start pipe server
     EVENT_LOOP.create_task(monitorpipe(fd_pipe))
-    EVENT_LOOP.create_task(citeproc())
+
+    # Start render socket, unless another pmpm-websocket serves it
+    render_socket = RUNTIME_DIR / "socket"
+    if render_socket_in_use(render_socket):
+        print(f"{render_socket} is served by another pmpm-websocket, "
+              "not serving render requests")
+    else:
+        if render_socket.is_socket():
+            render_socket.unlink()
+        global RENDER_SERVER
+        RENDER_SERVER = EVENT_LOOP.run_until_complete(
+            asyncio.start_unix_server(serve_render_requests,
+                                      path=render_socket,
+                                      limit=RENDER_REQUEST_LIMIT))
+
+    # pmpm --start checks this rather than connecting, removed on exit
+    with (RUNTIME_DIR / "pid").open('w') as f:
+        f.write(str(os.getpid()))
+    # e.g. pmpm --stop or systemctl stop
+    EVENT_LOOP.add_signal_handler(signal.SIGTERM, EVENT_LOOP.stop)
+
+    if ARGS.profile:
+        global PROFILER
+        PROFILER = Profiler(RUNTIME_DIR / "profile", ARGS.profile_keep,
+                            ARGS.profile_cprofile_every)
+
+    startup = EVENT_LOOP.create_task(deferred_startup())
 
     print('\n'
           f"pmpm-websocket started (port {ARGS.port})\n\n"
@@ -209,8 +496,86 @@ def run_websocket_server():
           f"    file://{client_path}"
           + (f"?port={ARGS.port}\n" if ARGS.port != '9877' else '\n') +
           "to view the rendered markdown"
+          + (f"\n\nWatching {', '.join(ARGS.watch)}" if ARGS.watch else "")
+          + (f"\n\nWriting render profiles to {PROFILER.directory}"
+             if PROFILER is not None else "")
           )
-    EVENT_LOOP.run_forever()
+    try:
+        EVENT_LOOP.run_forever()
+    finally:
+        removepidfile()
+    # stopped on SIGTERM, or if the deferred startup failed
+    if startup.done():
+        startup.result()
+
+
+def removepidfile():
+    """ remove the pid file, unless another server wrote it meanwhile """
+    pidfile = RUNTIME_DIR / "pid"
+    try:
+        if pidfile.read_text() == str(os.getpid()):
+            pidfile.unlink()
+    except OSError:
+        pass
+
+
+async def deferred_startup():
+    """ probe pandoc, start the pandoc workers, watchers and so on
+
+    Renders wait for STARTED, which is set once pandoc can be called.
+    """
+    try:
+        global FILES
+        FILES = inotify.FileTracker(dependencies_changed)
+
+        # Init pandoc command to be called later
+        init_pandoc_calls(
+            await EVENT_LOOP.run_in_executor(None, pandoc_capabilities))
+
+        if ARGS.disk_cache_size:
+            global DISKCACHE
+            DISKCACHE = DiskCache(ARGS.disk_cache_dir,
+                                  ARGS.disk_cache_size * 1024 * 1024)
+
+        # Start warm pandoc workers
+        if ARGS.pandoc_backend != "subprocess":
+            global PANDOC_POOL
+            pool = pandocpool.PandocPool(ARGS.pandoc_backend,
+                                         ARGS.pandoc_workers)
+            try:
+                await pool.start()
+                PANDOC_POOL = pool
+            except pandocpool.PandocPoolError as e:
+                print(f"--pandoc-backend {ARGS.pandoc_backend} disabled, "
+                      f"using pandoc subprocesses: {e}")
+    except Exception:
+        # nothing could be rendered
+        EVENT_LOOP.stop()
+        raise
+    STARTED.set()
+
+    if ARGS.fast_writer:
+        EVENT_LOOP.create_task(check_fast_writer())
+
+    # Watch markdown files
+    if ARGS.watch:
+        global WATCHER
+        WATCHER = watch.Watcher([ARGS.home / p for p in ARGS.watch],
+                                newcontent)
+        try:
+            WATCHER.start()
+        except OSError as e:
+            # the server is still useful without
+            print(f"Cannot watch {', '.join(ARGS.watch)}: {e}")
+
+    # Pre-warm the caches while idle
+    if ARGS.prewarm:
+        global PREWARMER
+        PREWARMER = prewarming.Prewarmer(
+            [ARGS.home / p for p in ARGS.prewarm_path] or [ARGS.home],
+            ARGS.prewarm, ARGS.prewarm_cpu, prewarm,
+            PANDOC_POOL.pids if PANDOC_POOL is not None else None)
+        EVENT_LOOP.create_task(PREWARMER.run())
 
 
 async def monitorpipe(sd_fd):
@@ -226,106 +591,498 @@ async def monitorpipe(sd_fd):
 class ReadPipeProtocol(asyncio.Protocol):
 
     def __init__(self, *args, **kwargs):
-        self._received = []
+        self._buffer = PipeBuffer()
 
     def data_received(self, data):
-        self._received.append(data)
-        if data.endswith(b'\0'):
-            self._queue()
+        self._buffer.feed(data)
+        self._queue()
 
     def eof_received(self):
         # Send file content also on EOF, not just on \0
         # But: Don't send an empty file on EOF. E.g.
         #     echo -n '# Hello world\0' > pipe
-        # sends \0 followed by EOF, where the \0 already triggers a _queue().
-        # Without this condition, EOF would then again trigger a _queue() with
-        # empty content, so clients would how nothing instead of "Hello world"
-        if len(self._received):
-            self._queue()
-
-    def _queue(self):
-        global QUEUE
-        QUEUE = ('pipe', self._received)
-        EVENT_LOOP.create_task(processqueue())
-        self._received = []
+        # sends \0 followed by EOF, where the \0 already queued the content,
+        # and nothing is left in the buffer.
+        self._queue(eof=True)
+
+    def _queue(self, eof=False):
+        while True:
+            try:
+                message = self._buffer.next_message(eof)
+                if message is None:
+                    return
+                fpath, slidelevel, content = decode_pipe_content(*message)
+            except Exception as e:
+                traceback.print_exc()
+                EVENT_LOOP.create_task(
+                    send_message_to_js_clients(FOLLOWERS, {"error": str(e)}))
+                continue
+            newcontent(fpath, content, slidelevel)
 
     def connection_lost(self, transport):
         PIPE_LOST.set()
 
 
-async def progressbar():
+def newcontent(fpath, content, slidelevel=None, done=None, renderid=None):
+    """ queue content piped in, read by WATCHER or sent to the render socket
+
+    Switches FOLLOWERS to the session of the document.
+
+    Args:
+        fpath: the absolute filepath
+        content: str: the markdown
+        slidelevel: render revealjs slides at this slide level (str)
+        done: future resolved with the result of the render
+        renderid: the id of the render request
+
+    """
+    global PIPESESSION
+    PIPESESSION = getsession(fpath)
+    for client in FOLLOWERS:
+        subscribe(client, PIPESESSION, exclusive=True)
+    queuecontent(PIPESESSION, ('pipe', content, slidelevel), done, renderid)
+
+
+async def serve_render_requests(reader, writer):
+    """ serve render requests on RUNTIME_DIR/socket
+
+    Requests are json objects, one per line, with the markdown "content",
+    optionally the "filepath" (relative to home or absolute) and the
+    "slide-level" for revealjs slides. Each request is answered right away
+    with its "id" and "status": "queued", or "error". Once rendered, the
+    result follows with the "id", see renderresult, where "timings" are the
+    seconds spent in each stage. With --profile, the trace of the render is
+    named by its id.
+    """
+    def reply(message):
+        if not writer.is_closing():
+            writer.write(json.dumps(message).encode() + b"\n")
+
+    def replyresult(renderid, done):
+        reply({"id": renderid, **done.result()})
+
+    pending = []
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            renderid = next(RENDER_IDS)
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise TypeError("request must be a json object")
+                if not isinstance(request.get("content"), str):
+                    raise TypeError("content must be a string")
+                fpath, slidelevel, content = decode_pipe_content(
+                    request.get("filepath"),
+                    {k: v for k, v in request.items() if k == "slide-level"},
+                    request["content"])
+            except (KeyError, TypeError, ValueError) as e:
+                reply({"id": renderid, "status": "error",
+                       "error": f"invalid render request: {e!r}"})
+                continue
+            done = EVENT_LOOP.create_future()
+            done.add_done_callback(
+                lambda done, renderid=renderid: replyresult(renderid, done))
+            pending = [f for f in pending if not f.done()] + [done]
+            reply({"id": renderid, "status": "queued"})
+            newcontent(fpath, content, slidelevel, done, renderid)
+        # the client may close its end after the last request
+        if pending:
+            await asyncio.wait(pending)
+    except (ConnectionError, ValueError):
+        # disconnected, or a request longer than RENDER_REQUEST_LIMIT
+        pass
+    finally:
+        writer.close()
+
+
+class Session:
+    """ the render state of one document
+
+    Each document has its own queue and citeproc state, thus documents
+    previewed side by side neither cancel nor overwrite each other, and their
+    renders run concurrently (within the SCHEDULER limit). Messages go to the
+    subscribers of the session only.
+    """
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.subscribers = set()
+        self.queue = None
+        # futures resolved with the result of rendering the item in queue,
+        # the time it was queued and its render id
+        self.queuedone = []
+        self.queuedat = None
+        self.queueid = None
+        self.processing = False
+        # the task rendering the content taken from queue
+        self.rendering = None
+        # the trace of the last render taken from queue, with --profile
+        self.trace = None
+        self.bibqueue = None
+        self.bibprocessing = False
+        # the last citeproc input (jsondump, bibid, cwd), see citeproc_changed
+        self.citeprocinput = None
+        # message, htmlblocks, version of the last htmlblocks sent
+        self.lasthtmlblocks = None
+        # the last item queued, rendered again when dependencies change
+        self.lastitem = None
+        # bibliography and csl files
+        self.dependencies = set()
+        # local files linked by src attributes -> their url
+        self.assets = {}
+        # first and last htmlblock visible in the client that scrolled last
+        self.viewport = None
+        self.pacer = Pacer(ARGS.min_delay, ARGS.max_delay)
+
+    def stats(self):
+        return {"subscribers": len(self.subscribers),
+                "pacing": self.pacer.stats()}
+
+
+def getsession(fpath):
+    """ the session of the absolute filepath fpath """
+    if fpath not in SESSIONS:
+        SESSIONS[fpath] = Session(fpath)
+    return SESSIONS[fpath]
+
+
+def dropsession(session):
+    """ forget the session if nobody is interested in it anymore """
+    if session.subscribers:
+        return
+    if session.rendering is not None:
+        # nobody would see the result
+        session.rendering.cancel()
+    elif not session.processing and not session.bibprocessing:
+        SESSIONS.pop(session.fpath, None)
+        untrack_unused(session.dependencies | session.assets.keys())
+
+
+def subscribe(client, session, exclusive=False):
+    """ send the messages of session to client as well
+
+    Args:
+        client: the client to subscribe
+        session: the session to subscribe to
+        exclusive: unsubscribe the client from all other sessions
+
+    """
+    if exclusive:
+        for other in list(SESSIONS.values()):
+            if other is not session and client in other.subscribers:
+                unsubscribe(client, other)
+    session.subscribers.add(client)
+
+
+def unsubscribe(client, session):
+    session.subscribers.discard(client)
+    dropsession(session)
+
+
+def clientsessions(client):
+    return [s for s in SESSIONS.values() if client in s.subscribers]
+
+
+async def progressbar(session):
     for k in count(1):
-        await asyncio.sleep(.300)
+        await asyncio.sleep(session.pacer.tick())
         EVENT_LOOP.create_task(
-            send_message_to_all_js_clients(
+            send_message_to_js_clients(
+                session.subscribers,
                 {"status": ' 🞄 '*k}))
 
 
-async def processqueue():
-    global PROCESSING
-    global QUEUE
-    if not PROCESSING and QUEUE:
+def queuecontent(session, item, done=None, renderid=None):
+    """ queue item for processqueue
+
+    A render of older content of the same document still in progress is
+    cancelled, which kills its pandoc processes, unless the pacer holds
+    that it should finish. Blocks rendered so far remain in BLOCKCACHE.
+
+    Args:
+        done: future resolved with the result of the render, see
+            renderresult
+        renderid: the id of the render request, a new one from RENDER_IDS
+            if None
+    """
+    renderresult(session.queuedone, "superseded")
+    session.queuedone = [done] if done is not None else []
+    session.queuedat = EVENT_LOOP.time()
+    session.queueid = next(RENDER_IDS) if renderid is None else renderid
+    session.queue = session.lastitem = item
+    session.pacer.input()
+    if session.rendering is not None and session.pacer.supersede():
+        session.rendering.cancel()
+    EVENT_LOOP.create_task(processqueue(session))
+
+
+async def processqueue(session):
+    if not session.processing and session.queue:
+        trace = None
+        sending = None
+        status = "error"
+        # PREWARMER may be started during the render, resume only the
+        # prewarmer this render paused
+        paused = PREWARMER
         try:
-            PROCESSING = EVENT_LOOP.create_task(progressbar())
-            q, QUEUE = QUEUE, None
+            if paused is not None:
+                paused.pause()
+            session.processing = EVENT_LOOP.create_task(progressbar(session))
+            q, session.queue = session.queue, None
+            done, session.queuedone = session.queuedone, []
+            start = EVENT_LOOP.time()
+            timings = {"queued": start - session.queuedat}
+            RENDER_TIMINGS.set(timings)
+            if PROFILER is not None:
+                trace = PROFILER.start(session.queueid, session.fpath)
+                RENDER_TRACE.set(trace)
+                tracestart = time.perf_counter()
+                trace.span("queue", tracestart - timings["queued"],
+                           tracestart)
+            session.trace = trace
             if q[0] == 'pipe':
-                await new_pipe_content(q[1])
+                session.rendering = EVENT_LOOP.create_task(
+                    process_new_content(session, *q[1:]))
             # assume it can only be a filepath request then
             else:
-                await new_filepath_request(
-                        q[1], True if q[0] == 'revealjsfilepath' else False)
+                session.rendering = EVENT_LOOP.create_task(
+                    new_filepath_request(session, q[1]))
+            sending = await session.rendering
+            session.pacer.rendered(EVENT_LOOP.time() - start)
+            METRICS.observe("render", EVENT_LOOP.time() - start)
+            METRICS.count("renders_done")
+            status = "done"
+            # done, with the send timing, once the clients got it
+            sending.add_done_callback(
+                lambda _: renderresult(done, "done", timings))
+        except asyncio.CancelledError:
+            METRICS.count("renders_superseded")
+            status = "superseded"
+            renderresult(done, "superseded")
+            if not session.rendering.cancelled():
+                raise
+            # superseded by newer content
+            session.pacer.cancelled(EVENT_LOOP.time() - start)
         except Exception as e:
             message = {"error": str(e)}
+            METRICS.count("renders_failed")
+            renderresult(done, "error", error=str(e))
             traceback.print_exc()
-            EVENT_LOOP.create_task(send_message_to_all_js_clients(message))
+            EVENT_LOOP.create_task(
+                send_message_to_js_clients(session.subscribers, message))
         finally:
-            PROCESSING.cancel()
-            await asyncio.sleep(.300)
-            PROCESSING = False
-            EVENT_LOOP.create_task(processqueue())
-
-
-async def new_pipe_content(instrlist):
-    instr = b''.join(instrlist)
-    content = instr.decode()
-    # filepath passed along
-    if content.startswith('<!-- filepath:'):
-        endline = content.find('\n', 14)
-        if endline == -1:
-            fpath = ARGS.home / "LIVE"
-            content = ""
-        else:
-            # given path is relative to home or absolute
-            fpath = ARGS.home / content[14:endline-4]
-            content = content[endline+1:]
-    else:
-        fpath = ARGS.home / "LIVE"
+            if paused is not None:
+                paused.resume()
+            session.rendering = None
+            session.processing.cancel()
+            if trace is not None:
+                trace.span("render", tracestart, status=status)
+                if sending is None:
+                    PROFILER.finish(trace)
+                else:
+                    sending.add_done_callback(
+                        lambda _: PROFILER.finish(trace))
+            # coalesce content arriving meanwhile
+            await asyncio.sleep(session.pacer.delay())
+            session.processing = False
+            if session.queue:
+                EVENT_LOOP.create_task(processqueue(session))
+            else:
+                dropsession(session)
+
+
+async def prewarm(fpath):
+    """ render the file fpath into the caches, at the lowest priority """
+    content = await EVENT_LOOP.run_in_executor(None, readfile, fpath)
+    session = Session(fpath)
+    try:
+        with background():
+            await md2htmlblocks(content, fpath.parent, session)
+    finally:
+        untrack_unused(session.dependencies)
+    METRICS.count("prewarmed_files")
+
+
+def renderresult(futures, status, timings=None, error=None):
+    """ resolve the futures of a render request
+
+    Args:
+        status: "done", "superseded" by newer content of the document, or
+            "error"
+        timings: stage -> seconds, see stage
+        error: the error message
+
+    """
+    result = {"status": status}
+    if timings is not None:
+        result["timings"] = timings
+    if error is not None:
+        result["error"] = error
+    for future in futures:
+        if not future.done():
+            future.set_result(result)
+
+
+def dependencies_changed(paths):
+    """ update the sessions depending on the changed files
+
+    A changed bibliography or csl file only changes the citeproc result, see
+    citeproc_changed. Clients reload changed assets themselves.
+    """
+    for session in list(SESSIONS.values()):
+        if paths & session.dependencies:
+            citeproc_changed(session)
+        urls = [session.assets[p] for p in paths & session.assets.keys()]
+        if urls:
+            EVENT_LOOP.create_task(send_message_to_js_clients(
+                session.subscribers, {"reload": urls}))
+
+
+def citeproc_changed(session):
+    """ run citeproc again after a bibliography or csl file changed
+
+    Instead of rendering the document again, the clients get the htmlblocks
+    they hold along with the new bibid, then the new citeproc result.
+    """
+    jsondump, bibid, cwd = session.citeprocinput or (None, None, None)
+    if (jsondump is None or session.rendering is not None or session.queue
+            or session.lasthtmlblocks is None
+            or session.lasthtmlblocks[0].get("partial")):
+        # the render in progress may have seen the old file
+        if session.lastitem is not None:
+            queuecontent(session, session.lastitem)
+        return
+    bibinfo = json.loads(jsondump)
+    bibinfo.pop('bibliography_mtimes_', None)
+    bibinfo.pop('csl_mtime_', None)
+    try:
+        addbibmtimes(bibinfo, cwd)
+    except FileNotFoundError:
+        # let the render report the missing bibliography
+        queuecontent(session, session.lastitem)
+        return
+    citeproc_sub.cache.discard((digest(jsondump), bibid, cwd))
+    jsondump = json.dumps(bibinfo)
+    session.bibqueue = session.citeprocinput = jsondump, hash(jsondump), cwd
+    message, htmlblocks, _ = session.lasthtmlblocks
+    EVENT_LOOP.create_task(send_htmlblocks_to_js_clients(
+        session, {**message, "bibid": hash(jsondump)}, htmlblocks))
+    EVENT_LOOP.create_task(citeproc(session))
+
+
+def untrack_unused(paths):
+    """ stop tracking those of the files no session depends on """
+    used = set()
+    for session in SESSIONS.values():
+        used |= session.dependencies | session.assets.keys()
+    for path in paths - used:
+        FILES.untrack(path)
+
+
+def decode_pipe_content(filepath, options, content):
+    """ the filepath and the markdown of a message piped in
+
+    Args:
+        filepath, options, content: the message, see PipeBuffer
+
+    Returns:
+        fpath: the absolute filepath
+        slidelevel: the revealjs slide level (str), or None
+        content: str: the markdown
+
+    """
+    # given path is relative to home or absolute
+    fpath = ARGS.home / (filepath or "LIVE")
+    slidelevel = options.get("slide-level")
+    if slidelevel is not None:
+        slidelevel = str(int(slidelevel))
     # absolute fpath
-    fpath = fpath.resolve()
-    await process_new_content(fpath, content)
+    return fpath.resolve(), slidelevel, content
 
 
-async def new_filepath_request(fpath, revealjs):
+async def new_filepath_request(session, revealjs):
     content = await EVENT_LOOP.run_in_executor(None,
                                                readfile,
-                                               fpath)
-    await process_new_content(
-            fpath, "<!-- revealjs -->" + content if revealjs else content)
-
-
-async def process_new_content(fpath, content):
-    htmlblocks, supbib, refsectit, bibid, toc, toctitle = await md2htmlblocks(
-        content, fpath.parent)
-    message = {
-        "filepath": str(fpath.relative_to(ARGS.home)),
-        "htmlblocks": htmlblocks,
-        "suppress-bibliography": supbib,
-        "reference-section-title": refsectit,
-        "bibid": bibid,
-        "toc": toc,
-        "toc-title": toctitle
-        }
-    EVENT_LOOP.create_task(send_message_to_all_js_clients(message))
+                                               session.fpath)
+    # as slides, at the slide level of a <!-- revealjs:S --> in the file
+    slidelevel = None
+    if revealjs and not content.startswith("<!-- revealjs"):
+        slidelevel = "2"
+    return await process_new_content(session, content, slidelevel)
+
+
+async def process_new_content(session, content, slidelevel=None):
+    """ render content and send it to the subscribers of session
+
+    Returns:
+        the task sending the final htmlblocks, not awaited so that the next
+        render need not wait for the slowest client
+    """
+    fpath = session.fpath
+
+    def send(htmlblocks, supbib, refsectit, bibid, toc, toctitle,
+             partial=False):
+        message = {
+            "filepath": str(fpath.relative_to(ARGS.home)),
+            "suppress-bibliography": supbib,
+            "reference-section-title": refsectit,
+            "bibid": bibid,
+            "toc": toc,
+            "toc-title": toctitle
+            }
+        if partial:
+            message["partial"] = True
+        return EVENT_LOOP.create_task(
+            send_htmlblocks_to_js_clients(session, message, htmlblocks))
+
+    result = await md2htmlblocks(content, fpath.parent, session,
+                                 lambda *result: send(*result, partial=True),
+                                 slidelevel)
+    assets = session.assets
+    session.assets = {FILES.track(path): url
+                      for url, path in assetlinks(result[0])}
+    untrack_unused(assets.keys() - session.assets.keys())
+
+    async def sendresult():
+        with stage("send"):
+            await send(*result)
+
+    return EVENT_LOOP.create_task(sendresult())
+
+
+def deflateclient(client):
+    """ whether the client decompresses binary frames itself """
+    query = parse_qs(urlsplit(client.path).query)
+    return "deflate" in query.get("encoding", [])
+
+
+class ServerProtocol(websockets.WebSocketServerProtocol):
+
+    def process_extensions(self, headers, available_extensions):
+        # Clients deflating at application level would otherwise get large
+        # messages deflated twice, and once more per client
+        if deflateclient(self):
+            available_extensions = []
+        return super().process_extensions(headers, available_extensions)
+
+    async def process_request(self, path, request_headers):
+        # plain http requests for the server status, see `pmpm --status`
+        if urlsplit(path).path == "/status":
+            return (HTTPStatus.OK,
+                    [("Content-Type", "application/json")],
+                    json.dumps(serverstatus()).encode())
+        return None
+
+
+def serverstatus():
+    """ the sessions, cache statistics and METRICS """
+    return {"clients": len(JSCLIENTS),
+            "sessions": {str(s.fpath): s.stats() for s in SESSIONS.values()},
+            "cache": CACHE_BUDGET.stats(),
+            **METRICS.stats()}
 
 
 async def serve_client(client: websockets.WebSocketServerProtocol, path: str):
@@ -358,6 +1115,9 @@ async def register_client(client: websockets.WebSocketServerProtocol):
 
     """
     JSCLIENTS.add(client)
+    FOLLOWERS.add(client)
+    if PIPESESSION is not None and PIPESESSION.fpath in SESSIONS:
+        subscribe(client, PIPESESSION)
 
 
 async def unregister_client(client: websockets.WebSocketServerProtocol):
@@ -369,6 +1129,10 @@ async def unregister_client(client: websockets.WebSocketServerProtocol):
     """
     if client in JSCLIENTS:
         JSCLIENTS.remove(client)
+    FOLLOWERS.discard(client)
+    DELTACLIENTS.pop(client, None)
+    for session in clientsessions(client):
+        unsubscribe(client, session)
 
 
 def readfile(fpath):
@@ -381,63 +1145,271 @@ async def handle_message(client: websockets.WebSocketServerProtocol,
                          message: str):
     """ handle a message sent by one of the clients
     """
-    global QUEUE
     if message.startswith('filepath:'):
-        QUEUE = ('filepath', ARGS.home / message[9:])
-        EVENT_LOOP.create_task(processqueue())
+        session = getsession((ARGS.home / message[9:]).resolve())
+        subscribe(client, session, exclusive=True)
+        queuecontent(session, ('filepath', False))
     elif message.startswith('revealjs:filepath:'):
-        QUEUE = ('revealjsfilepath', ARGS.home / message[18:])
-        EVENT_LOOP.create_task(processqueue())
+        session = getsession((ARGS.home / message[18:]).resolve())
+        subscribe(client, session, exclusive=True)
+        queuecontent(session, ('filepath', True))
+    elif message.startswith('subscribe:'):
+        FOLLOWERS.discard(client)
+        session = getsession((ARGS.home / message[10:]).resolve())
+        subscribe(client, session)
+        if session.lasthtmlblocks is not None:
+            await client.send(encodemessage(client, htmlblocksmessage(
+                client, *session.lasthtmlblocks), {}))
+        elif session.queue is None and session.rendering is None:
+            queuecontent(session, ('filepath', False))
+    elif message.startswith('unsubscribe:'):
+        session = SESSIONS.get((ARGS.home / message[12:]).resolve())
+        if session is not None:
+            unsubscribe(client, session)
+    elif message == 'follow':
+        FOLLOWERS.add(client)
+    elif message == 'unfollow':
+        FOLLOWERS.discard(client)
+    elif message.startswith('protocol:'):
+        if message[9:] == str(DELTA_PROTOCOL_VERSION):
+            DELTACLIENTS[client] = (None, Counter())
+    elif message.startswith('viewport:'):
+        try:
+            first, last = map(int, message[9:].split(':'))
+        except ValueError:
+            return
+        for session in clientsessions(client):
+            session.viewport = first, last
+    elif message == 'stats':
+        await client.send(json.dumps({"stats": serverstatus()}))
+    elif message == 'resync':
+        if client in DELTACLIENTS:
+            DELTACLIENTS[client] = (None, Counter())
+        for session in clientsessions(client):
+            if session.lasthtmlblocks is not None:
+                await client.send(encodemessage(client, htmlblocksmessage(
+                    client, *session.lasthtmlblocks), {}))
     # assume it can only be a citeproc request then
     else:
-        EVENT_LOOP.create_task(citeproc())
+        for session in clientsessions(client):
+            EVENT_LOOP.create_task(citeproc(session))
 
 
-async def send_message_to_all_js_clients(message):
-    """ send updated body contents to javascript clients
+async def send_message_to_js_clients(clients, message):
+    """ send a message to javascript clients
 
     Args:
+        clients: the clients to send the message to
         message: dict: the message to send
 
     """
-    if JSCLIENTS:
-        jsonmessage = json.dumps(message)
-        for client in JSCLIENTS:
-            EVENT_LOOP.create_task(client.send(jsonmessage))
+    if clients:
+        with METRICS.timer("send_message"):
+            jsonmessage = json.dumps(message)
+            deflated = {}
+            await asyncio.gather(
+                *(client.send(encodemessage(client, jsonmessage, deflated))
+                  for client in clients),
+                return_exceptions=True)
+
+
+def encodemessage(client, jsonmessage, deflated):
+    """ encode a message for a client
+
+    Args:
+        client: the client to send the message to
+        jsonmessage: str: the json encoded message
+        deflated: dict: json message -> its binary frame, for the messages
+            encoded so far in this broadcast, so that each message is
+            deflated only once
+
+    Returns:
+        frame: str or bytes: the message as text or binary frame
+
+    """
+    if (not ARGS.compression_level
+            or len(jsonmessage) < ARGS.compression_threshold
+            or not deflateclient(client)):
+        return jsonmessage
+    # keyed by the message itself, not its id(), which a message garbage
+    # collected meanwhile could have had (str caches its hash)
+    if jsonmessage not in deflated:
+        deflated[jsonmessage] = BINARY_FRAME_DEFLATE + zlib.compress(
+            jsonmessage.encode(), ARGS.compression_level)
+    return deflated[jsonmessage]
 
 
-async def citeproc():
-    global BIBPROCESSING
-    global BIBQUEUE
-    if not BIBPROCESSING and BIBQUEUE:
+async def send_htmlblocks_to_js_clients(session, message, htmlblocks):
+    """ send updated htmlblocks to the subscribers of session
+
+    Args:
+        session: the session of the document
+        message: dict: the message to send along
+        htmlblocks: list of [hash, html]
+
+    """
+    version = next(HTMLBLOCKS_VERSIONS)
+    session.lasthtmlblocks = message, htmlblocks, version
+    # clients holding the same version get the same message
+    jsonmessages = {}
+    deflated = {}
+    sends = []
+    start = EVENT_LOOP.time()
+    for client in session.subscribers:
+        if message.get("partial") and client not in DELTACLIENTS:
+            # would get all htmlblocks over and over again
+            continue
+        base = DELTACLIENTS[client][0] if client in DELTACLIENTS else 'full'
+        if base in jsonmessages:
+            jsonmessage, state = jsonmessages[base]
+            if state is not None:
+                DELTACLIENTS[client] = state
+        else:
+            jsonmessage = htmlblocksmessage(client, message, htmlblocks,
+                                            version)
+            jsonmessages[base] = jsonmessage, DELTACLIENTS.get(client)
+        sends.append(EVENT_LOOP.create_task(client.send(
+            encodemessage(client, jsonmessage, deflated))))
+    if sends:
+        await asyncio.gather(*sends, return_exceptions=True)
+        METRICS.observe("send_htmlblocks", EVENT_LOOP.time() - start)
+
+
+def htmlblocksmessage(client, message, htmlblocks, version):
+    if client not in DELTACLIENTS:
+        return json.dumps({"htmlblocks": htmlblocks, **message})
+
+    base, held = DELTACLIENTS[client]
+    # send the html of all blocks the client does not hold (often enough)
+    needed = Counter()
+    newblocks = []
+    for h, html in htmlblocks:
+        needed[h] += 1
+        if needed[h] > held[h]:
+            newblocks.append([h, html])
+    DELTACLIENTS[client] = (version, needed)
+    return json.dumps({"blockorder": [h for h, _ in htmlblocks],
+                       "newblocks": newblocks,
+                       "version": version,
+                       "base": base,
+                       **message})
+
+
+async def citeproc(session):
+    if not session.bibprocessing and session.bibqueue:
+        # the trace of the current render, not of the one whose context this
+        # task inherited
+        trace = session.trace
+        RENDER_TRACE.set(trace)
         try:
-            q, BIBQUEUE, BIBPROCESSING = BIBQUEUE, None, True
+            q, session.bibqueue = session.bibqueue, None
+            session.bibprocessing = True
             if q[0] and q[1]:
-                citehtml = await EVENT_LOOP.create_task(citeproc_sub(*q))
+                with priority(PRIORITY_CITEPROC), traced("citeproc"):
+                    citehtml = await EVENT_LOOP.create_task(citeproc_sub(*q))
             else:
                 citehtml = ''
             EVENT_LOOP.create_task(
-                send_message_to_all_js_clients({'html': citehtml,
-                                                'bibid': q[1]}))
+                send_message_to_js_clients(session.subscribers,
+                                           {'html': citehtml,
+                                            'bibid': q[1]}))
         finally:
-            BIBPROCESSING = False
-        EVENT_LOOP.create_task(citeproc())
+            session.bibprocessing = False
+            if trace is not None:
+                # citeproc usually finishes after the render, update its trace
+                PROFILER.update(trace)
+        EVENT_LOOP.create_task(citeproc(session))
 
 
-@alru_cache(maxsize=LRU_CACHE_SIZE_FULL_FILE)
+@cached(LRUCache("citeproc_sub", CACHE_BUDGET),
+        key=lambda jsondump, bibid, cwd: (digest(jsondump or ""), bibid,
+                                          cwd))
+@METRICS.timed("citeproc_sub")
 async def citeproc_sub(jsondump, bibid, cwd):
     if jsondump and bibid:
-        proc = await asyncio.subprocess.create_subprocess_exec(
-            *PANDOC_CALLS['citeproc'],
-            cwd=cwd,
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.DEVNULL)
-        stdout, stderr = await proc.communicate(jsondump.encode())
-        return stdout.decode()
+        if BIBINDEX is not None:
+            # pass only the cited entries of the bibliography
+            jsondump = await BIBINDEX.filter(jsondump, cwd)
+        return await run_pandoc_diskcached(PANDOC_CALLS['citeproc'],
+                                           jsondump, cwd)
     return ''
 
 
+class PandocError(Exception):
+    """ pandoc failed, e.g. because of a missing bibliography or because it
+    was killed """
+
+    def __init__(self, returncode, output):
+        super().__init__(f"pandoc exited with {returncode}")
+        self.output = output
+
+
+async def run_pandoc(args, text, cwd=None, check=False):
+    """ run pandoc, once SCHEDULER has a slot for the context's priority
+
+    Args:
+        args: the pandoc call
+        text: the input to pandoc
+        cwd: the working directory for pandoc
+        check: whether to raise PandocError if pandoc fails
+
+    Returns:
+        output: str: the output of pandoc, possibly empty or partial if it
+            failed and not check
+
+    """
+    waiting = time.perf_counter()
+    async with SCHEDULER.slot():
+        trace = RENDER_TRACE.get()
+        if trace is not None:
+            trace.span("wait for slot", waiting)
+        with traced("pandoc", call=" ".join(args[1:])):
+            if PANDOC_POOL is not None:
+                try:
+                    result = await PANDOC_POOL.run(args, text)
+                    METRICS.count("pandoc_pool_runs")
+                    return result
+                except pandocpool.PandocPoolError:
+                    # not supported by the workers or the worker crashed
+                    pass
+            METRICS.count("pandoc_subprocesses")
+            proc = await asyncio.subprocess.create_subprocess_exec(
+                *args,
+                cwd=cwd,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL)
+            try:
+                stdout, stderr = await proc.communicate(text.encode())
+            except asyncio.CancelledError:
+                # the render was superseded, do not let pandoc finish
+                proc.kill()
+                METRICS.count("pandoc_killed")
+                raise
+            if proc.returncode:
+                METRICS.count("pandoc_failed")
+                if check:
+                    raise PandocError(proc.returncode, stdout.decode())
+            return stdout.decode()
+
+
+async def run_pandoc_diskcached(args, text, cwd=None):
+    """ run_pandoc, but look up the result in DISKCACHE first """
+    if DISKCACHE is None:
+        return await run_pandoc(args, text, cwd)
+    key = cachekey(PANDOC_VERSION, args, cwd, text)
+    out, = await DISKCACHE.get([key])
+    METRICS.count("diskcache_hits" if out is not None else "diskcache_misses")
+    if out is None:
+        try:
+            out = await run_pandoc(args, text, cwd, check=True)
+        except PandocError as e:
+            # do not keep a failure for good
+            return e.output
+        DISKCACHE.put([(key, out)])
+    return out
+
+
 async def uniqueciteprocdict(jsondict, cwd):
     # keep only the blocks and bib-relevant metadata
     metakeys = {'bibliography',
@@ -456,76 +1428,385 @@ async def uniqueciteprocdict(jsondict, cwd):
     if not bibinfo['meta']:
         return (None, None)
 
-    # add bibliography_mtimes_ to uniqueify
+    addbibmtimes(bibinfo, cwd)
+    info = json.dumps(bibinfo)
+    return info, hash(info)
+
+
+def addbibmtimes(bibinfo, cwd):
+    """ add the modification times of the bibliography and csl files to the
+    citeproc input, to uniqueify
+
+    Raises:
+        FileNotFoundError: if a bibliography file does not exist
+
+    """
     bibliography = bibinfo['meta'].get('bibliography', None)
     if bibliography:
-        if bibliography['t'] == 'MetaInlines':
-            bibfiles = [cwd / bibliography['c'][0]['c']]
-        else:
-            bibfiles = [cwd / b['c'][0]['c']
-                        for b in bibliography['c']]
-        bibinfo['bibliography_mtimes_'] = [b.stat().st_mtime
-                                           for b in bibfiles]
+        bibinfo['bibliography_mtimes_'] = [
+            FILES.mtime(b)
+            for b in bibliography_files(bibliography, cwd)]
 
-    # add csl_mtime_ to uniqueify
     try:
-        bibinfo['csl_mtime_'] = (
-            cwd / bibinfo['meta']['csl']['c'][0]['c']
-            ).stat().st_mtime
+        bibinfo['csl_mtime_'] = FILES.mtime(
+            cwd / bibinfo['meta']['csl']['c'][0]['c'])
     except (FileNotFoundError, IndexError, KeyError, TypeError):
         pass
 
-    info = json.dumps(bibinfo)
-    return info, hash(info)
+
+def citeprocfiles(meta, cwd):
+    """ the bibliography and csl files of a document """
+    files = []
+    if 'bibliography' in meta:
+        files += bibliography_files(meta['bibliography'], cwd)
+    try:
+        files.append(cwd / meta['csl']['c'][0]['c'])
+    except (IndexError, KeyError, TypeError):
+        pass
+    return files
 
 
-@alru_cache(maxsize=LRU_CACHE_SIZE_FULL_FILE)
+@cached(LRUCache("md2json", CACHE_BUDGET),
+        key=lambda content, cwd: (digest(content), cwd))
+@METRICS.timed("md2json")
 async def md2json(content, cwd):
-    proc = await asyncio.subprocess.create_subprocess_exec(
-        *PANDOC_CALLS['md2json'],
-        cwd=cwd,
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.DEVNULL)
-    stdout, stderr = await proc.communicate(content.encode())
-    return json.loads(stdout.decode())
+    """ convert markdown to pandoc json
+
+    Returns:
+        jsonout: dict: the pandoc json document, shared by all callers and
+            the cache, not to be mutated
+
+    """
+    return json.loads(
+        await run_pandoc_diskcached(PANDOC_CALLS['md2json'], content, cwd))
+
 
+@METRICS.timed("json2htmlblock")
+async def json2htmlblock(key, jsontxt, cwd, options):
+    # only called for blocks not in BLOCKCACHE, see json2htmlblocks
+    htmlblock = htmlblockpostprocess(
+        await run_pandoc(PANDOC_CALLS["json2htmlblock"] + options,
+                         jsontxt, cwd),
+        cwd, options)
+    BLOCKCACHE.put(key, htmlblock)
+    return htmlblock
 
-@alru_cache(maxsize=LRU_CACHE_SIZE_BLOCK)
-async def json2htmlblock(jsontxt, cwd, options):
-    return await EVENT_LOOP.run_in_executor(
-        None, json2htmlblock_sub, jsontxt, cwd, options)
+
+def blockkey(blockjson, cwd, options, apiversion):
+    """ the BLOCKCACHE key of a block, the DISKCACHE keys derive from it
+
+    Args:
+        blockjson: the json of the list of pandoc blocks
+        apiversion: the pandoc-api-version of blockjson, the same json may
+            render differently under another one
+    """
+    return digest(str(cwd), "\0".join(options), json.dumps(apiversion),
+                  blockjson)
+
+
+def standalone(blockjson, apiversion):
+    """ the blocks as standalone pandoc json document """
+    return (f'{{"blocks": {blockjson}, "meta": {{}}, '
+            f'"pandoc-api-version": {json.dumps(apiversion)}}}')
 
 
 urlRegex = re.compile('(href|src)=[\'"](?!/|https://|http://|#)(.*)[\'"]')
 
 
-def json2htmlblock_sub(jsontxt, cwd, options):
-    proc = subprocess.Popen(
-        PANDOC_CALLS["json2htmlblock"] + options,
-        cwd=cwd,
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.DEVNULL)
-    stdout, stderr = proc.communicate(jsontxt.encode())
+def htmlblockpostprocess(html, cwd, options):
     html = urlRegex.sub(
         f'\\1="file://{cwd}/\\2" onclick="return localLinkClickEvent(this);"',
-        stdout.decode())
+        html)
     if "revealjs" in options and html.startswith("<section>\n"):
         html = html[10:-11]
     return [hash(html), html]
 
 
-@alru_cache(maxsize=LRU_CACHE_SIZE_BLOCK)
+assetRegex = re.compile('src="(file://([^"]*))"')
+
+
+def assetlinks(htmlblocks):
+    """ yield the url and path of the local files linked by src attributes """
+    for _, html in htmlblocks:
+        # most blocks link no files
+        if 'src="file://' in html:
+            for m in assetRegex.finditer(html):
+                yield m.group(1), Path(unquote(m.group(2)))
+
+
+def batchable(blockjson, options):
+    # revealjs output is grouped into sections around the blocks and
+    # footnotes are collected at the end of the output, so neither can be
+    # split back into blocks
+    return "revealjs" not in options and '"t": "Note"' not in blockjson
+
+
+def placeholder(key):
+    """ htmlblock shown until the block is rendered """
+    html = '<div class="pmpm-placeholder"></div>'
+    return [hash(("placeholder", key)), html]
+
+
+async def json2htmlblocks(blocks, blockjsons, cwd, options, apiversion,
+                          viewport=None, partial=None):
+    """ convert blocks to html blocks
+
+    Cached blocks are taken from BLOCKCACHE, with --fast-writer simple blocks
+    are rendered by blocks2html, the others are rendered in at most one
+    pandoc call per core instead of one pandoc call per block.
+    If viewport is given, the blocks in and around it are rendered first
+    and passed to partial, with placeholders for the other blocks.
+
+    Args:
+        blocks: list of lists of pandoc json blocks
+        blockjsons: the json of each list of blocks
+        cwd: the directory of the markdown file
+        options: the pandoc output options
+        apiversion: the pandoc-api-version of the blocks
+        viewport: (first, last) index of the blocks visible in the client
+        partial: function called with the htmlblocks of the viewport, and
+            with --stream first with placeholders only and then whenever
+            more blocks are rendered
+
+    Returns:
+        htmlblocks: list of [hash, html]
+
+    """
+    keys = [blockkey(b, cwd, options, apiversion) for b in blockjsons]
+    htmlblocks = [BLOCKCACHE.get(key) for key in keys]
+    misses = [k for k, h in enumerate(htmlblocks) if h is None]
+    trace = RENDER_TRACE.get()
+    if trace is not None:
+        for k, h in enumerate(htmlblocks):
+            if h is not None:
+                trace.instant("json2htmlblock", index=k, cache="memory")
+    if misses and FAST_WRITER and options == FAST_WRITER_OPTIONS:
+        with traced("blocks2html", blocks=len(misses)):
+            for k in misses:
+                html = htmlwriter.blocks2html(blocks[k])
+                if html is not None:
+                    htmlblocks[k] = htmlblockpostprocess(html, cwd, options)
+                    BLOCKCACHE.put(keys[k], htmlblocks[k])
+        rendered = len(misses)
+        misses = [k for k in misses if htmlblocks[k] is None]
+        METRICS.count("fast_writer_blocks", rendered - len(misses))
+    if misses and DISKCACHE is not None:
+        diskkeys = {k: cachekey(PANDOC_VERSION,
+                                PANDOC_CALLS["json2htmlblock"] + options,
+                                keys[k].hex())
+                    for k in misses}
+        htmls = await DISKCACHE.get([diskkeys[k] for k in misses])
+        METRICS.count("diskcache_hits", sum(h is not None for h in htmls))
+        METRICS.count("diskcache_misses", sum(h is None for h in htmls))
+        for k, html in zip(misses, htmls):
+            if html is not None:
+                if trace is not None:
+                    trace.instant("json2htmlblock", index=k, cache="disk")
+                htmlblocks[k] = [hash(html), html]
+                BLOCKCACHE.put(keys[k], htmlblocks[k])
+        misses = [k for k in misses if htmlblocks[k] is None]
+
+    def sendpartial():
+        partial([h if h is not None else placeholder(key)
+                 for h, key in zip(htmlblocks, keys)])
+
+    progress = None
+    if ARGS.stream and partial is not None and misses:
+        # send the block order right away, then blocks as they are rendered
+        sendpartial()
+        lastsent = EVENT_LOOP.time()
+
+        def streamprogress():
+            nonlocal lastsent
+            if EVENT_LOOP.time() - lastsent >= STREAM_INTERVAL:
+                lastsent = EVENT_LOOP.time()
+                sendpartial()
+        progress = streamprogress
+
+    rest = misses
+    # if most blocks are cached, the others are what the user is editing
+    prio = PRIORITY_EDITING if len(misses) < len(keys) / 2 \
+        else PRIORITY_DEFAULT
+    if viewport is not None and partial is not None:
+        first, last = viewport[0] - VIEWPORT_MARGIN, \
+            viewport[1] + VIEWPORT_MARGIN
+        visible = [k for k in misses if first <= k <= last]
+        rest = [k for k in misses if not first <= k <= last]
+        if visible and rest:
+            with priority(PRIORITY_EDITING):
+                await renderhtmlblocks(htmlblocks, visible, blocks,
+                                       blockjsons, keys, cwd, options,
+                                       apiversion)
+            sendpartial()
+            prio = PRIORITY_DEFAULT
+        else:
+            rest = misses
+    with priority(prio):
+        await renderhtmlblocks(htmlblocks, rest, blocks, blockjsons, keys,
+                               cwd, options, apiversion, progress)
+
+    if DISKCACHE is not None:
+        DISKCACHE.put([(diskkeys[k], htmlblocks[k][1]) for k in misses])
+    return htmlblocks
+
+
+async def renderhtmlblocks(htmlblocks, misses, blocks, blockjsons, keys, cwd,
+                           options, apiversion, progress=None):
+    """ render the blocks with indices misses into htmlblocks
+
+    progress is called whenever some of the blocks are rendered; the blocks
+    are then rendered in smaller batches in document order.
+    """
+    batched = [k for k in misses if batchable(blockjsons[k], options)]
+    if len(batched) < 2:
+        batched = []
+    single = [k for k in misses if k not in set(batched)]
+
+    nbatches = min(SCHEDULER.limit, len(batched))
+    if progress is None or not batched:
+        batches = [batched[i::nbatches] for i in range(nbatches)]
+    else:
+        # contiguous batches, so that the document fills in from the top
+        size = min(-(-len(batched) // nbatches), STREAM_BATCH_SIZE)
+        batches = [batched[i:i + size] for i in range(0, len(batched), size)]
+
+    async def renderbatch(batch):
+        with traced("json2htmlblocks_batch", indices=batch, cache="miss"):
+            batchresult = await json2htmlblocks_batch(
+                [blocks[k] for k in batch], [keys[k] for k in batch],
+                cwd, options, apiversion)
+        if batchresult is None:
+            # splitting failed, render these blocks one by one after all
+            batchresult = await asyncio.gather(*(
+                renderblock(k) for k in batch))
+        for k, htmlblock in zip(batch, batchresult):
+            htmlblocks[k] = htmlblock
+        if progress is not None:
+            progress()
+
+    async def renderblock(k):
+        with traced("json2htmlblock", index=k, cache="miss"):
+            htmlblocks[k] = await json2htmlblock(
+                keys[k], standalone(blockjsons[k], apiversion), cwd, options)
+        if progress is not None:
+            progress()
+        return htmlblocks[k]
+
+    await asyncio.gather(*(renderbatch(batch) for batch in batches),
+                         *(renderblock(k) for k in single))
+
+
+async def json2htmls(blocks, cwd, options, apiversion):
+    """ render lists of blocks in one pandoc call
+
+    Returns:
+        htmls: the html of each list of blocks, None if pandoc's output
+            could not be split into them
+
+    """
+    sentinel = {"t": "RawBlock", "c": ["html", BLOCK_SENTINEL]}
+    jsontxt = json.dumps({
+        "blocks": [b for j in blocks for b in (sentinel, *j)],
+        "meta": {},
+        "pandoc-api-version": apiversion})
+    htmls = (await run_pandoc(PANDOC_CALLS["json2htmlblock"] + options,
+                              jsontxt, cwd)
+             ).split(BLOCK_SENTINEL + "\n")
+    if len(htmls) != len(blocks) + 1 or htmls[0]:
+        return None
+    return htmls[1:]
+
+
+@METRICS.timed("json2htmlblocks_batch")
+async def json2htmlblocks_batch(blocks, keys, cwd, options, apiversion):
+    htmls = await json2htmls(blocks, cwd, options, apiversion)
+    if htmls is None:
+        return None
+    htmlblocks = [htmlblockpostprocess(html, cwd, options) for html in htmls]
+    # cache each batch right away, should the render be cancelled meanwhile
+    for key, htmlblock in zip(keys, htmlblocks):
+        BLOCKCACHE.put(key, htmlblock)
+    return htmlblocks
+
+
+async def check_fast_writer():
+    """ enable blocks2html if it renders CONFORMANCE_MARKDOWN like pandoc
+
+    pandoc then renders blocks with --wrap=none too, as blocks2html does not
+    wrap lines.
+    """
+    global FAST_WRITER
+    try:
+        jsonout = json.loads(await run_pandoc(
+            PANDOC_CALLS["md2json"], htmlwriter.CONFORMANCE_MARKDOWN))
+        blocks = jsonout["blocks"]
+        htmls = await json2htmls([[b] for b in blocks], None,
+                                 FAST_WRITER_OPTIONS + ("--wrap=none",),
+                                 jsonout["pandoc-api-version"])
+    except (OSError, ValueError, KeyError):
+        traceback.print_exc()
+        return
+    if htmls is None or any(htmlwriter.conformance(blocks, htmls)):
+        print("--fast-writer disabled: the conformance samples are not "
+              "rendered like pandoc renders them")
+        return
+    PANDOC_CALLS["json2htmlblock"] += ("--wrap=none",)
+    FAST_WRITER = True
+
+
+async def md2json_incremental(content, cwd):
+    """ convert markdown to pandoc json, re-parsing only changed chunks
+
+    Args:
+        content: the markdown string to convert
+        cwd: the directory of the markdown file
+
+    Returns:
+        jsonout: dict: the pandoc json document, not to be mutated (see
+            md2json)
+
+    """
+    global CHUNK_API_VERSION
+    chunks = incremental.markdown_chunks(content)
+    if chunks is None or len(chunks) < 2:
+        return await md2json(content, cwd)
+
+    chunkkeys = [(digest(c), cwd) for c in chunks]
+    chunkblocks = [CHUNKCACHE.get(key) for key in chunkkeys]
+    misses = [k for k, b in enumerate(chunkblocks) if b is None]
+    if misses:
+        # parse all changed chunks in one go, separated by a raw html block
+        jsonout = await md2json(
+            "\n\n".join(f"{BLOCK_SENTINEL}\n\n{chunks[k]}" for k in misses),
+            cwd)
+        parsed = [[]]
+        for b in jsonout['blocks']:
+            if (b['t'] == 'RawBlock'
+                    and b['c'][1].strip() == BLOCK_SENTINEL):
+                parsed.append([])
+            else:
+                parsed[-1].append(b)
+        if len(parsed) != len(misses) + 1 or parsed[0] or jsonout['meta']:
+            return await md2json(content, cwd)
+        for k, blocks in zip(misses, parsed[1:]):
+            CHUNKCACHE.put(chunkkeys[k], blocks)
+            chunkblocks[k] = blocks
+        CHUNK_API_VERSION = jsonout['pandoc-api-version']
+
+    blocks = [b for c in chunkblocks for b in c]
+    if (CHUNK_API_VERSION is None
+            or not incremental.has_unique_header_ids(blocks)):
+        return await md2json(content, cwd)
+    return {"pandoc-api-version": CHUNK_API_VERSION, "meta": {},
+            "blocks": blocks}
+
+
+@cached(LRUCache("json2titleblock", CACHE_BUDGET),
+        key=lambda jsontxt, options: (digest(jsontxt), options))
+@METRICS.timed("json2titleblock")
 async def json2titleblock(jsontxt, options):
-    proc = await asyncio.subprocess.create_subprocess_exec(
-        *PANDOC_CALLS["json2titleblock"],
-        *options,
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.DEVNULL)
-    stdout, stderr = await proc.communicate(jsontxt.encode())
-    out = stdout.decode()
+    out = await run_pandoc_diskcached(
+        PANDOC_CALLS["json2titleblock"] + options, jsontxt)
     if "revealjs" in options:
         start = out.find('<section id="title-slide">')
         end = out.find('</section>', start) + 10
@@ -556,31 +1837,50 @@ def groupsections(blocks, slidelevel):
 
 
 # do not cache --> checkforbibdifferences
-async def md2htmlblocks(content, cwd):
+async def md2htmlblocks(content, cwd, session, partial=None,
+                        slidelevel=None):
     """ convert markdown to html using pandoc markdown
 
     Args:
         content: the markdown string to convert
+        cwd: the directory of the markdown file
+        session: the session of the document, for citeproc and the viewport
+        partial: function called with the result for the blocks in the
+            viewport before the other blocks are rendered
+        slidelevel: render revealjs slides at this slide level (str),
+            else if the content starts with <!-- revealjs --> or
+            <!-- revealjs:S --> at the slide level in there
 
     Returns:
         html: str: the resulting html
 
     """
+    if not STARTED.is_set():
+        with stage("startup"):
+            await STARTED.wait()
+
     options = ("--to", "html5")
     # slides detected if file starts with
     # <!-- revealjs --> or <!-- revealjs:S -->
-    # where S sets the slidelevel
+    # where S sets the slidelevel, unless given
     if content.startswith("<!-- revealjs"):
         # TODO: Do this without copying content 3 times
         if content[13:].startswith(":") and content[15:].startswith(" -->\n"):
-            slidelevel = content[14]
+            marked = content[14]
             content = content[20:]
         else:
-            slidelevel = "2"
+            marked = "2"
             content = content[18:]
+        if slidelevel is None:
+            slidelevel = marked
+    if slidelevel is not None:
         options = ("--to", "revealjs") + ("--slide-level", slidelevel)
 
-    jsonout = await EVENT_LOOP.create_task(md2json(content, cwd))
+    with priority(PRIORITY_EDITING), stage("md2json"):
+        if ARGS.incremental_parse:
+            jsonout = await md2json_incremental(content, cwd)
+        else:
+            jsonout = await EVENT_LOOP.create_task(md2json(content, cwd))
 
     # blocks are grouped into slidesections
     if "revealjs" in options:
@@ -588,32 +1888,32 @@ async def md2htmlblocks(content, cwd):
     else:
         blocks = ([j] for j in jsonout['blocks'])
 
-    global BIBQUEUE
-    BIBQUEUE = *(await uniqueciteprocdict(jsonout, cwd)), cwd
-    bibid = BIBQUEUE[1]
-    EVENT_LOOP.create_task(citeproc())
+    session.bibqueue = session.citeprocinput = \
+        *(await uniqueciteprocdict(jsonout, cwd)), cwd
+    dependencies = session.dependencies
+    session.dependencies = {FILES.track(f)
+                            for f in citeprocfiles(jsonout['meta'], cwd)}
+    untrack_unused(dependencies - session.dependencies)
+    bibid = session.bibqueue[1]
+    EVENT_LOOP.create_task(citeproc(session))
 
     # []
-    titleblock = await json2titleblock(
-        json.dumps({
-            "blocks": [],
-            "meta": {k: jsonout['meta'][k]
-                     for k in {"title",
-                               "subtitle",
-                               "author",
-                               "date"} & jsonout['meta'].keys()},
-            "pandoc-api-version": jsonout['pandoc-api-version']}),
-        options)
-
-    jsonlist = (
-        json.dumps({"blocks": j,
-                    "meta": {},
-                    "pandoc-api-version": jsonout['pandoc-api-version']})
-        for j in blocks)
-
-    htmlblocks = await asyncio.gather(*(
-        json2htmlblock(j, cwd, options)
-        for j in jsonlist))
+    with priority(PRIORITY_TITLE), stage("titleblock"):
+        titleblock = await json2titleblock(
+            json.dumps({
+                "blocks": [],
+                "meta": {k: jsonout['meta'][k]
+                         for k in {"title",
+                                   "subtitle",
+                                   "author",
+                                   "date"} & jsonout['meta'].keys()},
+                "pandoc-api-version": jsonout['pandoc-api-version']}),
+            options)
+
+    blocks = list(blocks)
+    # the cache keys are digests of these, the standalone documents are
+    # only built for blocks that are not cached
+    blockjsons = [json.dumps(j) for j in blocks]
 
     try:
         supbib = jsonout['meta']['suppress-bibliography']['c'] is True
@@ -635,6 +1935,23 @@ async def md2htmlblocks(content, cwd):
     except (IndexError, KeyError):
         toctitle = None
 
+    def viewportrendered(htmlblocks):
+        partial(titleblock + htmlblocks,
+                supbib,
+                refsectit,
+                bibid,
+                toc,
+                toctitle)
+
+    # the client counts the titleblock as well
+    viewport = None
+    if session.viewport is not None:
+        viewport = tuple(v - len(titleblock) for v in session.viewport)
+    with stage("htmlblocks"):
+        htmlblocks = await json2htmlblocks(
+            blocks, blockjsons, cwd, options, jsonout['pandoc-api-version'],
+            viewport, viewportrendered if partial is not None else None)
+
     return (titleblock + htmlblocks,
             supbib,
             refsectit,
@@ -28,7 +28,7 @@ if __name__ == "__main__":
         entry_points={"console_scripts": [
             "pmpm = pmpm.pmpm:main",
             "pmpm-websocket = pmpm.websocket:run_websocket_server"]},
-        python_requires=">=3.6",
+        python_requires=">=3.7",
         install_requires=install_requires,
         classifiers=[
             "Topic :: Utilities",
@@ -39,5 +39,6 @@ if __name__ == "__main__":
             "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
         ],
         packages=['pmpm', 'client'],
+        package_data={'pmpm': ['pandoc_worker.lua']},
         include_package_data=True,
     )
@@ -0,0 +1,39 @@
+"""
+blocks2html against the html pandoc renders the same blocks to
+
+tests/golden holds markdown files with pandoc's json and html5 of each of
+their blocks, written by bench/conformance.py --golden with the pandoc in
+tests/golden/pandoc-version, so that this runs without pandoc.
+"""
+
+
+import json
+from pathlib import Path
+
+import pytest
+
+from pmpm.htmlwriter import CONFORMANCE_MARKDOWN, blocks2html
+
+
+GOLDEN_DIR = Path(__file__).resolve().parent / "golden"
+SENTINEL = "<!-- pmpm-conformance -->"
+
+
+def golden(name):
+    """ the blocks of tests/golden/name.md and pandoc's html of each """
+    path = GOLDEN_DIR / name
+    blocks = json.loads(path.with_suffix(".json").read_text())["blocks"]
+    htmls = path.with_suffix(".html").read_text().split(SENTINEL + "\n")[1:]
+    assert len(blocks) == len(htmls)
+    return blocks, htmls
+
+
+def test_samples_are_current():
+    assert (GOLDEN_DIR / "samples.md").read_text() == CONFORMANCE_MARKDOWN
+
+
+@pytest.mark.parametrize(
+    "name", sorted(path.stem for path in GOLDEN_DIR.glob("*.md")))
+def test_blocks2html(name):
+    for block, html in zip(*golden(name)):
+        assert blocks2html([block]) == html, json.dumps(block)
@@ -0,0 +1,65 @@
+"""
+markdown_chunks splits only where pandoc's parse of one chunk cannot depend
+on the others, and gives up on documents where it might
+"""
+
+
+import pytest
+
+from pmpm.incremental import markdown_chunks
+
+
+SPLITTABLE = {
+    "paragraphs": ["a\n\n", "b\n"],
+    "closed fence": ["```\nx\n\ny\n```\n\n", "z\n"],
+    "closed div": ["::: note\na\n\nb\n:::\n\n", "c\n"],
+    "loose list": ["- a\n\n- b\n\n", "c\n"],
+    "indented code": ["a\n\n    code\n\n    more\n\n", "b\n"],
+    "rule": ["a\n\n", "---\n\n", "b\n"],
+    "multiline table": [
+        "para\n\n",
+        "-------------\n"
+        "A     B\n"
+        "----- -----\n"
+        "1     2\n"
+        "\n"
+        "3     4\n"
+        "-------------\n\n",
+        "after\n"],
+    "caption before pipe table": [
+        "para\n\nTable: cap\n\n| a |\n|---|\n| 1 |\n\n", "after\n"],
+    "colon caption before simple table": [
+        "para\n\n: cap\n\n  a   b\n  --- ---\n  1   2\n\n", "after\n"],
+    "caption after table": [
+        "  a   b\n  --- ---\n  1   2\n\nTable: cap\n\nafter\n"],
+    "unreferenced header": ["# A\n\n", "text [b]\n"],
+    "setext headers": ["A\n=\n\n", "text\n\n", "B\n-\n"],
+}
+
+UNSPLITTABLE = {
+    "open fence": "```\ncode\n\nmore\n",
+    "fence closed by a shorter fence": "~~~~\nx\n~~~\n\ny\n",
+    "open div": "::: note\ntext\n\nmore\n",
+    "open outer div": "::: a\n::: b\nx\n:::\n\ny\n",
+    "reference definition": "text [a]\n\n[a]: http://x\n",
+    "footnote": "text[^1]\n\n[^1]: note\n",
+    "yaml at the start": "---\ntitle: x\n---\n\ntext\n",
+    "yaml later on": "text\n\n---\ntitle: x\n...\n\nmore\n",
+    "title block": "% Title\n\ntext\n",
+    "implicit header reference": "# Intro\n\nsee [intro]\n",
+    "implicit header reference, whitespace":
+        "# My  Header\n\nsee [my header]\n",
+    "duplicate atx headers": "# A\n\ntext\n\n# A\n",
+    "duplicate setext headers": "A\n=\n\nx\n\nA\n-\n",
+}
+
+
+@pytest.mark.parametrize("name", SPLITTABLE)
+def test_split(name):
+    chunks = SPLITTABLE[name]
+    assert markdown_chunks("".join(chunks)) == chunks
+
+
+@pytest.mark.parametrize("name", UNSPLITTABLE)
+def test_unsplittable(name):
+    assert markdown_chunks(UNSPLITTABLE[name]) is None
@@ -0,0 +1,128 @@
+"""
+PipeBuffer assembles the messages piped in, whichever way the reads split
+them
+"""
+
+
+import pytest
+
+from pmpm.pipe import (FRAME_HEADER, MAX_FRAME_SIZE, PIPE_BUFFER_SIZE,
+                       PIPE_MAGIC, PipeBuffer, encode_frame)
+
+
+def messages(reads, eof=False):
+    """ the messages decoded after each of reads, and at eof """
+    buffer = PipeBuffer()
+    decoded = []
+    for data in reads:
+        buffer.feed(data)
+        while True:
+            message = buffer.next_message()
+            if message is None:
+                break
+            decoded.append(message)
+    while eof:
+        message = buffer.next_message(eof=True)
+        if message is None:
+            break
+        decoded.append(message)
+    return decoded
+
+
+def unframed(content, filepath=None):
+    return filepath, {}, content
+
+
+def test_two_messages_in_one_read():
+    assert messages([b"# A\0# B\0"]) == [unframed("# A"), unframed("# B")]
+
+
+def test_zero_in_the_middle_of_a_read():
+    assert messages([b"# A", b"bc\0# B", b"\0"]) == [
+        unframed("# Abc"), unframed("# B")]
+
+
+def test_eof_terminates_unframed_content():
+    assert messages([b"# A"]) == []
+    assert messages([b"# A"], eof=True) == [unframed("# A")]
+
+
+def test_eof_after_zero():
+    assert messages([b"# A\0"], eof=True) == [unframed("# A")]
+
+
+def test_filepath_line():
+    assert messages([b"<!-- filepath:notes/a.md -->\n# A\0"]) == [
+        unframed("# A", "notes/a.md")]
+
+
+def test_utf8_split_across_reads():
+    data = "# Ä\0".encode()
+    assert messages([data[:3], data[3:]]) == [unframed("# Ä")]
+
+
+FRAME = encode_frame("# A\0with zero", "a.md", {"slide-level": 2})
+
+
+@pytest.mark.parametrize("split", range(1, len(FRAME)))
+def test_frame_split_across_reads(split):
+    # including splits within PIPE_MAGIC and the header
+    assert messages([FRAME[:split], FRAME[split:]]) == [
+        ("a.md", {"slide-level": 2}, "# A\0with zero")]
+
+
+def test_frame_byte_by_byte():
+    assert messages([FRAME[k:k + 1] for k in range(len(FRAME))]) == [
+        ("a.md", {"slide-level": 2}, "# A\0with zero")]
+
+
+def test_frames_mixed_with_unframed_content():
+    reads = [b"# plain\0" + encode_frame("# framed") + b"# pla",
+             b"in again\0" + encode_frame("# last", "b.md")]
+    assert messages(reads) == [unframed("# plain"),
+                               (None, {}, "# framed"),
+                               unframed("# plain again"),
+                               ("b.md", {}, "# last")]
+
+
+def test_large_frame_in_small_reads():
+    content = "x" * (3 * PIPE_BUFFER_SIZE)
+    frame = encode_frame(content)
+    reads = [frame[k:k + 1000] for k in range(0, len(frame), 1000)]
+    assert messages(reads + [b"# next\0"]) == [
+        (None, {}, content), unframed("# next")]
+
+
+def test_large_unframed_message_in_small_reads():
+    data = b"y" * (3 * PIPE_BUFFER_SIZE) + b"\0# next\0"
+    reads = [data[k:k + 1000] for k in range(0, len(data), 1000)]
+    assert messages(reads) == [unframed("y" * (3 * PIPE_BUFFER_SIZE)),
+                               unframed("# next")]
+
+
+def test_oversized_frame():
+    buffer = PipeBuffer()
+    buffer.feed(PIPE_MAGIC + FRAME_HEADER.pack(0, 0, MAX_FRAME_SIZE) + b"x")
+    with pytest.raises(ValueError):
+        buffer.next_message()
+    # the rest of the frame is dropped, later messages are decoded
+    assert buffer.next_message() is None
+    buffer.feed(b"# B\0")
+    assert buffer.next_message() == unframed("# B")
+
+
+def test_incomplete_frame_at_eof():
+    buffer = PipeBuffer()
+    buffer.feed(FRAME[:-1])
+    assert buffer.next_message() is None
+    with pytest.raises(ValueError):
+        buffer.next_message(eof=True)
+    assert buffer.next_message(eof=True) is None
+
+
+def test_invalid_render_options():
+    buffer = PipeBuffer()
+    buffer.feed(encode_frame("# A", options={"unknown": 1}) + b"# B\0")
+    with pytest.raises(ValueError):
+        buffer.next_message()
+    assert buffer.next_message() == unframed("# B")